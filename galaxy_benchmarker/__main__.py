@@ -6,9 +6,7 @@ from time import sleep
 from benchmarker import Benchmarker
 import logging
 import time
-import requests
 import os
-from requests.adapters import HTTPAdapter
 
 logging.basicConfig()
 log = logging.getLogger("GalaxyBenchmarker")
@@ -22,9 +20,6 @@ os.makedirs(os.path.dirname(log_filename), exist_ok=True)
 fh = logging.FileHandler(log_filename, mode='w')
 log.addHandler(fh)
 
-s = requests.Session()
-s.mount('http://', HTTPAdapter(max_retries=20))
-
 
 def main():
     parser = argparse.ArgumentParser()
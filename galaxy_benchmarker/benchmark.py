@@ -2,16 +2,19 @@
 Definition of different benchmark-types.
 """
 import logging
+import sys
 import time
 import threading
-import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import uuid
 from datetime import datetime
 from destination import BaseDestination, GalaxyDestination, PulsarMQDestination, GalaxyCondorDestination, CondorDestination
 from workflow import BaseWorkflow, GalaxyWorkflow, CondorWorkflow
-from task import BaseTask, AnsiblePlaybookTask, BenchmarkerTask
-from typing import List, Dict, Union
+from task import BaseTask, AnsiblePlaybookTask
+from typing import List, Dict, Iterator, Tuple, Union
 from task import configure_task
 from influxdb_bridge import InfluxDB
+from metrics import ParsedMetric
 from bioblend import ConnectionError
 
 
@@ -22,8 +25,8 @@ class BaseBenchmark:
     """
     The Base-Class of Benchmark. All Benchmarks should inherit from it.
     """
-    allowed_dest_types = []
-    allowed_workflow_types = []
+    allowed_dest_types = frozenset()
+    allowed_workflow_types = frozenset()
     benchmarker = None
     galaxy = None
     benchmark_results = dict()
@@ -38,6 +41,9 @@ class BaseBenchmark:
         self.destinations = destinations
         self.workflows = workflows
         self.runs_per_workflow = runs_per_workflow
+        # Tag of the benchmark-type in InfluxDB. Keeps the str() of the class, as the Grafana-dashboards filter
+        # on values like "<class 'benchmark.ColdWarmBenchmark'>"
+        self._type_tag = str(type(self))
 
     def run_pre_task(self):
         """
@@ -62,46 +68,51 @@ class BaseBenchmark:
     def run(self, benchmarker):
         raise NotImplementedError
 
-    def save_results_to_influxdb(self, inflxdb: InfluxDB):
+    def iter_runs(self) -> Iterator[Tuple[str, str, str, Dict]]:
         """
-        Sends all the metrics of the benchmark_results to influxDB.
+        Iterates over all the runs in benchmark_results as flat (run_type, destination_name, workflow_name, run)
+        records. Runs that are None are skipped.
         """
         for run_type, per_dest_results in self.benchmark_results.items():
             for dest_name, workflows in per_dest_results.items():
                 for workflow_name, runs in workflows.items():
                     for run in runs:
-                        if run is None:
-                            continue
-
-                        if "workflow_metrics" in run:
-                            # Save metrics per workflow-run
-                            tags = {
-                                "benchmark_name": self.name,
-                                "benchmark_uuid": self.uuid,
-                                "benchmark_type": type(self),
-                                "destination_name": dest_name,
-                                "workflow_name": workflow_name,
-                                "history_name": run["history_name"] if "history_name" in run else None,
-                                "run_type": run_type,
-                            }
-
-                            inflxdb.save_workflow_metrics(tags, run["workflow_metrics"])
-
-                        # Save job-metrics if workflow succeeded
-                        if runs is None or run["status"] == "error" or "jobs" not in run or run["jobs"] is None:
-                            continue
-
-                        for job in run["jobs"].values():
-                            tags = {
-                                "benchmark_name": self.name,
-                                "benchmark_uuid": self.uuid,
-                                "benchmark_type": type(self),
-                                "destination_name": dest_name,
-                                "workflow_name": workflow_name,
-                                "history_name": run["history_name"] if "history_name" in run else None,
-                                "run_type": run_type,
-                            }
-                            inflxdb.save_job_metrics(tags, job)
+                        if run is not None:
+                            yield run_type, dest_name, workflow_name, run
+
+    def save_results_to_influxdb(self, inflxdb: InfluxDB):
+        """
+        Sends all the metrics of the benchmark_results to influxDB.
+        """
+        # Tags that are the same for every metric of this benchmark
+        benchmark_tags = {
+            "benchmark_name": self.name,
+            "benchmark_uuid": self.uuid,
+            "benchmark_type": self._type_tag,
+        }
+
+        for run_type, dest_name, workflow_name, run in self.iter_runs():
+            # Same tags for the workflow-metrics and all job-metrics of the run (only read, never changed)
+            tags = {
+                **benchmark_tags,
+                "destination_name": dest_name,
+                "workflow_name": workflow_name,
+                "history_name": run.get("history_name"),
+                "run_type": run_type,
+            }
+
+            if "workflow_metrics" in run:
+                # Save metrics per workflow-run
+                inflxdb.save_workflow_metrics(tags, run["workflow_metrics"])
+
+            # Save job-metrics if workflow succeeded
+            if run["status"] == "error" or run.get("jobs") is None:
+                continue
+
+            inflxdb.save_job_metrics_batch(tags, run["jobs"].values())
+
+        # Write the remaining buffered metrics
+        inflxdb.flush()
 
     def __str__(self):
         return self.name
@@ -110,8 +121,8 @@ class BaseBenchmark:
 
 
 class ColdWarmBenchmark(BaseBenchmark):
-    allowed_dest_types = [GalaxyDestination, PulsarMQDestination]
-    allowed_workflow_types = [GalaxyWorkflow]
+    allowed_dest_types = frozenset({GalaxyDestination, PulsarMQDestination})
+    allowed_workflow_types = frozenset({GalaxyWorkflow})
     cold_pre_task: AnsiblePlaybookTask = None
     warm_pre_task: AnsiblePlaybookTask = None
 
@@ -139,8 +150,8 @@ class ColdWarmBenchmark(BaseBenchmark):
 
 
 class DestinationComparisonBenchmark(BaseBenchmark):
-    allowed_dest_types = [GalaxyDestination, PulsarMQDestination, GalaxyCondorDestination]
-    allowed_workflow_types = [GalaxyWorkflow]
+    allowed_dest_types = frozenset({GalaxyDestination, PulsarMQDestination, GalaxyCondorDestination})
+    allowed_workflow_types = frozenset({GalaxyWorkflow})
 
     def __init__(self, name, benchmarker, destinations: List[Union[PulsarMQDestination, GalaxyDestination]],
                  workflows: List[GalaxyWorkflow], galaxy, runs_per_workflow=1, warmup=True):
@@ -165,15 +176,18 @@ class DestinationComparisonBenchmark(BaseBenchmark):
 
 
 class BurstBenchmark(BaseBenchmark):
-    allowed_dest_types = [GalaxyDestination, GalaxyCondorDestination, PulsarMQDestination, CondorDestination]
-    allowed_workflow_types = [GalaxyWorkflow, CondorWorkflow]
+    allowed_dest_types = frozenset({GalaxyDestination, GalaxyCondorDestination, PulsarMQDestination,
+                                    CondorDestination})
+    allowed_workflow_types = frozenset({GalaxyWorkflow, CondorWorkflow})
 
     background_tasks: List[Dict] = list()
 
     def __init__(self, name, benchmarker, destinations: List[BaseDestination],
-                 workflows: List[BaseWorkflow], runs_per_workflow=1, burst_rate=1):
+                 workflows: List[BaseWorkflow], runs_per_workflow=1, burst_rate=1, max_parallel_runs=None):
         super().__init__(name, benchmarker, destinations, workflows, runs_per_workflow)
         self.burst_rate = burst_rate
+        # Maximum number of workflows running at the same time. None: all runs_per_workflow may run at once
+        self.max_parallel_runs = max_parallel_runs
 
         if len(self.destinations) != 1:
             raise ValueError("BurstBenchmark can only be used with exactly one Destination.")
@@ -199,8 +213,14 @@ class BurstBenchmark(BaseBenchmark):
         background_task_process = self.BackgroundTaskThread(self)
         background_task_process.start()
 
-        threads = []
         results = [None]*self.runs_per_workflow
+        futures = dict()
+        # Threads are reused for later runs once a workflow is finished. If max_parallel_runs is set, further
+        # runs wait for a free thread, so fewer runs than burst_rate might be started per second then
+        max_workers = self.runs_per_workflow
+        if self.max_parallel_runs is not None:
+            max_workers = min(max_workers, self.max_parallel_runs)
+        pool = ThreadPoolExecutor(max_workers=max_workers)
         total_runs = next_runs = 0
         while total_runs < self.runs_per_workflow:
             next_runs += self.burst_rate
@@ -214,9 +234,7 @@ class BurstBenchmark(BaseBenchmark):
                 next_runs = self.runs_per_workflow - total_runs
 
             for _ in range(0, int(next_runs)):
-                process = self.BurstThread(self, total_runs, results)
-                process.start()
-                threads.append(process)
+                futures[pool.submit(self._run_single, total_runs)] = total_runs
                 total_runs += 1
 
             next_runs = 0
@@ -224,11 +242,15 @@ class BurstBenchmark(BaseBenchmark):
 
         # Wait for all Benchmarks being executed
         finished_jobs = 0
-        for process in threads:
-            process.join()
+        for future in as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except Exception as e:
+                log.error("Run {run_id} failed: {error}".format(run_id=futures[future], error=e))
             finished_jobs += 1
             log.info("{finished} out of {total} workflows are finished.".format(finished=finished_jobs,
                                                                                 total=total_runs))
+        pool.shutdown()
         background_task_process.stop = True
 
         self.benchmark_results = {
@@ -251,77 +273,58 @@ class BurstBenchmark(BaseBenchmark):
                 return
 
             log.info("Starting to run BackgroundTaskThread")
+            # All times are kept in nanoseconds as ints, sys.maxsize means "never run again"
+            now = time.monotonic_ns()
             for task in self.bm.background_tasks:
-                task["next_run"] = time.monotonic() + task["first_run_after"]
+                task["next_run"] = now + int(task["first_run_after"] * 1_000_000_000)
+                task["run_every_ns"] = int(task["run_every"] * 1_000_000_000)
                 if "run_until" in task:
-                    task["run_until"] += time.monotonic()
+                    task["run_until"] = now + int(task["run_until"] * 1_000_000_000)
 
             while True:
                 for task in self.bm.background_tasks:
-                    if task["next_run"] <= time.monotonic():
+                    if task["next_run"] <= time.monotonic_ns():
                         log.info("Running background task {task}".format(task=task))
                         task["task"].run()
-                        task["next_run"] = time.monotonic() + task["run_every"]
+                        task["next_run"] = time.monotonic_ns() + task["run_every_ns"]
                     if "run_until" in task:
-                        if task["run_until"] <= time.monotonic() and task["next_run"] < float("inf"):
-                            task["next_run"] = float("inf")
+                        if task["run_until"] <= time.monotonic_ns() and task["next_run"] < sys.maxsize:
+                            task["next_run"] = sys.maxsize
                             log.info("Stopped background task {task}, as run_until passed".format(task=task))
                 if self.stop:
                     break
 
                 time.sleep(1)
 
-    class BurstThread(threading.Thread):
+    def _run_single(self, run_id) -> Dict:
         """
-        Class to run a Workflow within a thread to allow multiple runs a the same time.
+        Runs a GalaxyWorkflow or a CondorWorkflow. Called within the thread pool of run to allow multiple
+        runs at the same time.
         """
-        def __init__(self, bm, thread_id, results: List):
-            threading.Thread.__init__(self)
-            self.bm = bm
-            self.thread_id = thread_id
-            self.results = results
+        log.info("Running with run_id {run_id}".format(run_id=run_id))
+        result = None
+        if self.destination_type is PulsarMQDestination:
+            try:
+                res = run_galaxy_benchmark(self, self.galaxy, self.destinations, self.workflows,
+                                           1, "warm", False)
+                result = res[self.destinations[0].name][self.workflows[0].name][0] # TODO: Handle error-responses
+            except ConnectionError:
+                log.error("ConnectionError!")
+                result = {"status": "error"}
 
-        def run(self):
-            """
-            Runs a GalaxyWorkflow or a CondorWorkflow.
-            """
-            log.info("Running with thread_id {thread_id}".format(thread_id=self.thread_id))
-            if self.bm.destination_type is PulsarMQDestination:
-                try:
-                    res = run_galaxy_benchmark(self, self.bm.galaxy, self.bm.destinations, self.bm.workflows,
-                                               1, "warm", False)
-                    self.results[self.thread_id] = res[self.bm.destinations[0].name][self.bm.workflows[0].name][0] # TODO: Handle error-responses
-                except ConnectionError:
-                    log.error("ConnectionError!")
-                    self.results[self.thread_id] = {"status": "error"}
-
-            if self.bm.destination_type is CondorDestination:
-                for destination in self.bm.destinations:
-                    for workflow in self.bm.workflows:
-                        result = destination.run_workflow(workflow)
-                        result["history_name"] = str(time.time_ns()) + str(random.randrange(0, 99999))
-                        result["workflow_metrics"] = {
-                            "status": {
-                                "name": "workflow_status",
-                                "type": "string",
-                                "plugin": "benchmarker",
-                                "value": result["status"]
-                            },
-                            "total_runtime": {
-                                "name": "total_workflow_runtime",
-                                "type": "float",
-                                "plugin": "benchmarker",
-                                "value": result["total_workflow_runtime"]
-                            },
-                            "submit_time": {
-                                "name": "submit_time",
-                                "type": "float",
-                                "plugin": "benchmarker",
-                                "value": result["submit_time"]
-                            }
-                        }
+        if self.destination_type is CondorDestination:
+            for destination in self.destinations:
+                for workflow in self.workflows:
+                    result = destination.run_workflow(workflow)
+                    result["history_name"] = uuid.uuid4().hex[:16]
+                    result["workflow_metrics"] = {
+                        "status": ParsedMetric("workflow_status", "string", "benchmarker", result["status"]),
+                        "total_runtime": ParsedMetric("total_workflow_runtime", "float", "benchmarker",
+                                                      result["total_workflow_runtime"]),
+                        "submit_time": ParsedMetric("submit_time", "float", "benchmarker", result["submit_time"])
+                    }
 
-                self.results[self.thread_id] = result
+        return result
 
 
 def run_galaxy_benchmark(benchmark, galaxy, destinations: List[PulsarMQDestination],
@@ -367,21 +370,13 @@ def run_galaxy_benchmark(benchmark, galaxy, destinations: List[PulsarMQDestinati
                         result = destination.run_workflow(workflow)
 
                         if "history_name" in result and result["status"] == "success":
-                            result["jobs"] = destination.get_jobs(result["history_name"])
+                            result["jobs"] = destination.get_jobs(result["history_name"],
+                                                                  history_id=result.get("history_id"))
 
                         result["workflow_metrics"] = {
-                            "status": {
-                                "name": "workflow_status",
-                                "type": "string",
-                                "plugin": "benchmarker",
-                                "value": result["status"]
-                            },
-                            "total_runtime": {
-                                "name": "total_workflow_runtime",
-                                "type": "float",
-                                "plugin": "benchmarker",
-                                "value": result["total_workflow_runtime"]
-                            }
+                            "status": ParsedMetric("workflow_status", "string", "benchmarker", result["status"]),
+                            "total_runtime": ParsedMetric("total_workflow_runtime", "float", "benchmarker",
+                                                          result["total_workflow_runtime"])
                         }
 
                         log.info("Finished running '{workflow}' with status '{status}' in {time} seconds."
@@ -451,7 +446,7 @@ def configure_benchmark(bm_config: Dict, destinations: Dict, workflows: Dict, gl
         benchmark = BurstBenchmark(bm_config["name"], benchmarker,
                                    _get_needed_destinations(bm_config, destinations, BurstBenchmark),
                                    _get_needed_workflows(bm_config, workflows, BurstBenchmark),
-                                   runs_per_workflow, bm_config["burst_rate"])
+                                   runs_per_workflow, bm_config["burst_rate"], bm_config.get("max_parallel_runs"))
         benchmark.galaxy = glx
 
         if "background_tasks" in bm_config:
@@ -461,28 +456,21 @@ def configure_benchmark(bm_config: Dict, destinations: Dict, workflows: Dict, gl
                 benchmark.background_tasks.append(task_conf)
 
     if "pre_tasks" in bm_config:
-        benchmark.pre_tasks = list()
-        for task in bm_config["pre_tasks"]:
-            if task["type"] == "AnsiblePlaybook":
-                benchmark.pre_tasks.append(AnsiblePlaybookTask(benchmark, task["playbook"]))
-            elif task["type"] == "BenchmarkerTask":
-                benchmark.pre_tasks.append(BenchmarkerTask(benchmark, task["name"]))
-            else:
-                raise ValueError("Task of type '{type}' is not supported".format(type=task["type"]))
+        benchmark.pre_tasks = _configure_tasks(bm_config["pre_tasks"], benchmark)
 
     if "post_tasks" in bm_config:
-        benchmark.post_tasks = list()
-        for task in bm_config["post_tasks"]:
-            if task["type"] == "AnsiblePlaybook":
-                benchmark.post_tasks.append(AnsiblePlaybookTask(benchmark, task["playbook"]))
-            elif task["type"] == "BenchmarkerTask":
-                benchmark.post_tasks.append(BenchmarkerTask(benchmark, task["name"]))
-            else:
-                raise ValueError("Task of type '{type}' is not supported".format(type=task["type"]))
+        benchmark.post_tasks = _configure_tasks(bm_config["post_tasks"], benchmark)
 
     return benchmark
 
 
+def _configure_tasks(task_confs: List[Dict], benchmark) -> List[BaseTask]:
+    """
+    Returns the configured tasks for a list of task-configurations (like pre_tasks or post_tasks).
+    """
+    return [configure_task(task_conf, benchmark) for task_conf in task_confs]
+
+
 def _get_needed_destinations(bm_config: Dict, destinations: Dict, bm_type) -> List:
     """
     Returns a list of the destinations that were set in the configuration of the benchmark.
@@ -490,17 +478,20 @@ def _get_needed_destinations(bm_config: Dict, destinations: Dict, bm_type) -> Li
     if "destinations" not in bm_config or bm_config["destinations"] is None or len(bm_config["destinations"]) == 0:
         raise ValueError("No destination set in benchmark '{name}'".format(name=bm_config["name"]))
 
+    # The exact type is checked, as e.g. PulsarMQDestination is a subclass of GalaxyDestination
+    allowed_dest_types = bm_type.allowed_dest_types
     needed_destinations = list()
     for dest_name in bm_config["destinations"]:
         # Make sure, that destination exists
         if dest_name not in destinations:
             raise ValueError("Destination '{name}' not set in workflows-configuration.".format(name=dest_name))
+        destination = destinations[dest_name]
         # Make sure, that destination-type is allowed
-        if type(destinations[dest_name]) not in bm_type.allowed_dest_types:
+        if type(destination) not in allowed_dest_types:
             raise ValueError("Destination-Type {dest} is not allowed in benchmark-type {bm}. \
-                             Error in benchmark name {bm_name}".format(dest=type(destinations[dest_name]),
+                             Error in benchmark name {bm_name}".format(dest=type(destination),
                                                                        bm=type(bm_type), bm_name=bm_config["name"]))
-        needed_destinations.append(destinations[dest_name])
+        needed_destinations.append(destination)
 
     return needed_destinations
 
@@ -512,17 +503,19 @@ def _get_needed_workflows(bm_config: Dict, workflows: Dict, bm_type) -> List:
     if "workflows" not in bm_config or bm_config["workflows"] is None or len(bm_config["workflows"]) == 0:
         raise ValueError("No workflow set in benchmark '{name}'".format(name=bm_config["name"]))
 
+    allowed_workflow_types = bm_type.allowed_workflow_types
     needed_workflows = list()
     for wf_name in bm_config["workflows"]:
         # Make sure, that workflow exists
         if wf_name not in workflows:
             raise ValueError("Workflow '{name}' not set in workflows-configuration.".format(name=wf_name))
+        workflow = workflows[wf_name]
         # Make sure, that workflow-type is allowed
-        if type(workflows[wf_name]) not in bm_type.allowed_workflow_types:
+        if type(workflow) not in allowed_workflow_types:
             raise ValueError("Workflow-Type {wf} is not allowed in benchmark-type {bm}. \
-                                         Error in benchmark name {bm_name}".format(wf=type(workflows[wf_name]),
+                                         Error in benchmark name {bm_name}".format(wf=type(workflow),
                                                                                    bm=type(bm_type),
                                                                                    bm_name=bm_config["name"]))
-        needed_workflows.append(workflows[wf_name])
+        needed_workflows.append(workflow)
 
     return needed_workflows
@@ -2,11 +2,13 @@ from typing import Dict
 import workflow
 import destination
 import benchmark
+import ansible_bridge
 from galaxy_bridge import Galaxy
 import logging
 import json
 from influxdb_bridge import InfluxDB
 from openstack_bridge import OpenStackCompute
+from metrics import ParsedMetric
 
 log = logging.getLogger("GalaxyBenchmarker")
 
@@ -25,6 +27,11 @@ class Benchmarker:
                           glx_conf.get("galaxy_root_path", None), glx_conf.get("galaxy_config_dir", None),
                           glx_conf.get("galaxy_user", None))
 
+        if "ansible" in config:
+            ansible_conf = config["ansible"]
+            ansible_bridge.persist_connections = ansible_conf.get("persist_connections", False)
+            ansible_bridge.pipelining = ansible_conf.get("pipelining", False)
+
         if "influxdb" in config:
             inf_conf = config["influxdb"]
             self.inflx_db = InfluxDB(inf_conf["host"], inf_conf["port"], inf_conf["username"], inf_conf["password"],
@@ -36,7 +43,8 @@ class Benchmarker:
             os_conf = config["openstack"]
             self.openstack = OpenStackCompute(os_conf["auth_url"], os_conf["compute_endpoint_version"],
                                               os_conf["username"], os_conf["password"], os_conf["project_id"],
-                                              os_conf["region_name"], os_conf["user_domain_name"])
+                                              os_conf["region_name"], os_conf["user_domain_name"],
+                                              os_conf.get("servers_cache_ttl", 30))
 
         self.workflows = dict()
         for wf_config in config["workflows"]:
@@ -53,7 +61,7 @@ class Benchmarker:
 
         if glx_conf.get("configure_job_destinations", False):
             log.info("Creating job_conf for Galaxy and deploying it")
-            destination.create_galaxy_job_conf(self.glx, self.destinations)
+            destination.create_galaxy_job_conf(self.glx)
             self.glx.deploy_job_conf()
 
         if glx_conf["shed_install"]:
@@ -83,12 +91,20 @@ class Benchmarker:
         for bm in self.benchmarks.values():
             results.append(bm.benchmark_results)
 
-        json_results = json.dumps(results, indent=2)
+        json_results = json.dumps(results, indent=2, default=_to_json)
         with open(filename+".json", "w") as fh:
             fh.write(json_results)
 
     def send_results_to_influxdb(self):
         for bm in self.benchmarks.values():
             bm.save_results_to_influxdb(self.inflx_db)
+        self.inflx_db.wait_for_writes()
 
 
+def _to_json(obj):
+    """
+    Makes the objects within the benchmark_results serializable by json.dumps.
+    """
+    if isinstance(obj, ParsedMetric):
+        return obj.to_dict()
+    raise TypeError("Object of type {type} is not JSON serializable".format(type=type(obj).__name__))
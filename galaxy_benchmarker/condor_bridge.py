@@ -1,10 +1,17 @@
 import paramiko
-import re
-from typing import List, Dict
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import Iterator, List, Dict, Set, Tuple
 import json
 import metrics
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 
 def get_paramiko_client(host, username, key_file):
     key = paramiko.RSAKey.from_private_key_file(key_file)
@@ -15,6 +22,89 @@ def get_paramiko_client(host, username, key_file):
     return client
 
 
+class SSHConnectionPool:
+    """
+    Keeps one SSH-connection per (host, username, key_file), so all runs and CondorDestinations with the
+    same host share the TCP-connection and only authenticate once. The number of concurrently open channels
+    per connection is limited, as sshd refuses more than MaxSessions (default: 10).
+    """
+    max_sessions = 9
+    keepalive_interval = 30
+
+    def __init__(self):
+        # Only guards _host_locks. Connecting is done under the lock of the host, so a slow or unreachable
+        # host doesn't block the others
+        self._lock = threading.Lock()
+        # key: (host, username, key_file), value: lock for connecting to it
+        self._host_locks: Dict[Tuple, threading.Lock] = dict()
+        # key: (host, username, key_file), value: (client, semaphore)
+        self._connections: Dict[Tuple, Tuple[paramiko.SSHClient, threading.Semaphore]] = dict()
+
+    def _get_connection(self, host, username, key_file) -> Tuple[paramiko.SSHClient, threading.Semaphore]:
+        key = (host, username, key_file)
+        with self._lock:
+            host_lock = self._host_locks.setdefault(key, threading.Lock())
+
+        with host_lock:
+            client, semaphore = self._connections.get(key, (None, None))
+            transport = client.get_transport() if client is not None else None
+            if transport is None or not transport.is_active():
+                client = get_paramiko_client(host, username, key_file)
+                client.get_transport().set_keepalive(self.keepalive_interval)
+                if semaphore is None:
+                    semaphore = threading.Semaphore(self.max_sessions)
+                self._connections[key] = (client, semaphore)
+
+        return client, semaphore
+
+    @contextmanager
+    def acquire(self, host, username, key_file):
+        """
+        Yields the shared SSHClient for the host. Don't close it, it's released back to the pool afterwards.
+        """
+        client, semaphore = self._get_connection(host, username, key_file)
+        with semaphore:
+            yield client
+
+
+_connection_pool = SSHConnectionPool()
+# Already created JobStatusPollers and CondorHistoryFetchers.
+# key: (class, host, username, key_file, refresh_time, max_refresh_time)
+_batched_requests: Dict[Tuple, "BatchedJobRequest"] = dict()
+_batched_requests_lock = threading.Lock()
+
+
+def ssh_session(host, username, key_file):
+    """
+    Returns a context manager with the pooled SSHClient for the host (see SSHConnectionPool).
+    """
+    return _connection_pool.acquire(host, username, key_file)
+
+
+def _get_batched_request(cls, host, username, key_file, refresh_time, max_refresh_time=None):
+    key = (cls, host, username, key_file, refresh_time, max_refresh_time)
+    with _batched_requests_lock:
+        if key not in _batched_requests:
+            _batched_requests[key] = cls(host, username, key_file, refresh_time, max_refresh_time)
+        return _batched_requests[key]
+
+
+def get_status_poller(host, username, key_file, refresh_time, max_refresh_time=None) -> "JobStatusPoller":
+    """
+    Returns the JobStatusPoller for the host, so the jobs of all CondorDestinations on it (with the same
+    refresh times) are checked together.
+    """
+    return _get_batched_request(JobStatusPoller, host, username, key_file, refresh_time, max_refresh_time)
+
+
+def get_history_fetcher(host, username, key_file, refresh_time) -> "CondorHistoryFetcher":
+    """
+    Returns the CondorHistoryFetcher for the host, so the history of all CondorDestinations on it is fetched
+    together.
+    """
+    return _get_batched_request(CondorHistoryFetcher, host, username, key_file, refresh_time)
+
+
 def submit_job(client: paramiko.SSHClient, workflow_dir, job_file):
     """
     Submits Condor-Job and returns the ID and a (start, end) of the sub-id range as a Dict.
@@ -41,37 +131,175 @@ def submit_job(client: paramiko.SSHClient, workflow_dir, job_file):
     }
 
 
-def get_job_status(client: paramiko.SSHClient, job_id):
+def get_done_jobs(client: paramiko.SSHClient, job_ids: List[str]) -> Set[str]:
     """
-    Determines, job-status. If all jobs were run (status="done"), total_jobs and everything else will be 0
+    Checks the status of all the given jobs with a single condor_q-call and returns the ids of the ones that are
+    done. A job is done, if none of its sub-jobs is idle or running anymore.
     """
-    stdin, stdout, stderr = client.exec_command("condor_q {job_id}".format(job_id=job_id))
+    stdin, stdout, stderr = client.exec_command("condor_q -af ClusterId JobStatus {job_ids}"
+                                                .format(job_ids=" ".join(job_ids)))
+
+    error = ""
+    for err in stderr:
+        error += err
 
-    status = None
+    if error != "":
+        raise ValueError("An error with condor_q occurred: {error}".format(error=error))
+
+    # JobStatus 1 = idle, 2 = running (see metrics.condor_job_status)
+    active = set()
     for output in stdout:
-        if output.find("jobs;") != -1:
-            status = list(map(int, re.findall(r'\d+', output)))
+        fields = output.split()
+        if len(fields) == 2 and fields[1] in ("1", "2"):
+            active.add(fields[0])
 
-    if status is None or len(status) != 7:
-        raise Exception("Couldn't parse condor_q")
+    return set(job_ids) - active
 
-    return {
-        "status": "done" if status[0] == 0 or (status[3] == 0 and status[4] == 0) else "running",
-        "total_jobs": status[0],
-        "completed": status[1],
-        "idle": status[3],
-        "running": status[4],
-        "held": status[5]
-    }
 
+class BatchedJobRequest:
+    """
+    Collects the job_ids of all threads that wait for a result (e.g. the runs of a BurstBenchmark) and handles
+    them with a single request, instead of one request per job. Subclasses implement _request.
+
+    The first request is sent every refresh_time seconds. As long as no result comes in, the interval grows
+    by backoff_factor up to max_refresh_time. It never gets longer than max_refresh_ratio of the time the
+    newest job has been waiting, so the measured runtimes stay accurate for short jobs.
+    """
+    backoff_factor = 1.5
+    max_refresh_time = 30
+    max_refresh_ratio = 0.05
+
+    def __init__(self, host, username, key_file, refresh_time, max_refresh_time=None):
+        self.host = host
+        self.username = username
+        self.key_file = key_file
+        self.refresh_time = refresh_time
+        if max_refresh_time is not None:
+            self.max_refresh_time = max_refresh_time
+        self._lock = threading.Lock()
+        # key: job_id, value: Future that is resolved with the result for the job
+        self._waiting: Dict[str, Future] = dict()
+        self._thread = None
+        # Set, when a new job is waited for, so the backoff is reset
+        self._new_job = threading.Event()
+        self._newest_job_since = time.monotonic()
+
+    def _request(self, client: paramiko.SSHClient, job_ids: List[str]) -> Dict:
+        """
+        Returns the results for the given jobs as a dict (key: job_id). Jobs without a result are requested
+        again with the next request.
+        """
+        raise NotImplementedError
+
+    def wait(self, job_id):
+        """
+        Blocks until the result for the job is there and returns it. Raises the error of the request, if
+        there was one.
+        """
+        future = Future()
+        with self._lock:
+            self._waiting[job_id] = future
+            self._newest_job_since = time.monotonic()
+            self._new_job.set()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._poll, daemon=True)
+                self._thread.start()
+
+        return future.result()
+
+    def _poll(self):
+        delay = self.refresh_time
+        while True:
+            with self._lock:
+                # Stop, if no one is waiting anymore. A new thread is started with the next wait
+                if len(self._waiting) == 0:
+                    self._thread = None
+                    return
+                job_ids = list(self._waiting)
+                self._new_job.clear()
+
+            try:
+                with ssh_session(self.host, self.username, self.key_file) as client:
+                    results = self._request(client, job_ids)
+            except Exception as e:
+                with self._lock:
+                    for job_id in job_ids:
+                        self._waiting.pop(job_id).set_exception(e)
+                continue
+
+            with self._lock:
+                for job_id, result in results.items():
+                    self._waiting.pop(job_id).set_result(result)
+
+            if len(results) != 0:
+                delay = self.refresh_time
+            else:
+                delay = min(delay * self.backoff_factor, self.max_refresh_time,
+                            max(self.refresh_time,
+                                (time.monotonic() - self._newest_job_since) * self.max_refresh_ratio))
 
-def get_condor_history(client: paramiko.SSHClient, first_id: float, last_id: float = float("inf")) -> Dict[str, Dict]:
+            # Start over with refresh_time, if a new job came in meanwhile
+            if self._new_job.wait(delay):
+                delay = self.refresh_time
+
+
+class JobStatusPoller(BatchedJobRequest):
+    """
+    Waits for Condor-jobs to finish. All the jobs that are waited for at the same time are checked with a single
+    condor_q-call, with a growing interval for long-running jobs.
+    """
+    def _request(self, client, job_ids):
+        return {job_id: "done" for job_id in get_done_jobs(client, job_ids)}
+
+    def wait_until_done(self, job_id):
+        """
+        Blocks until the job is done. Raises the error of condor_q, if there was one.
+        """
+        return self.wait(job_id)
+
+
+class CondorHistoryFetcher(BatchedJobRequest):
     """
-    Returns condor_history as a list of jobs. Returns all job_ids >= first_id
+    Fetches condor_history for finished jobs. The history of all the jobs that finished meanwhile is fetched
+    with a single condor_history-call and then split up by ClusterId.
     """
-    output_filename = "condor_history_" + str(datetime.now().timestamp()) + ".json"
-    stdin, stdout, stderr = client.exec_command("condor_history -backwards -json -since {i} > {filename}"
-                                                .format(i=int(first_id)-1, filename=output_filename))
+    def _request(self, client, job_ids):
+        results = {job_id: dict() for job_id in job_ids}
+        for job in iter_condor_history(client, min(float(job_id) for job_id in job_ids), set(job_ids)):
+            results[str(job["ClusterId"])][job["id"]] = job
+
+        return results
+
+
+def iter_condor_history(client: paramiko.SSHClient, first_id: float, cluster_ids: Set[str] = None) -> Iterator[Dict]:
+    """
+    Yields the jobs of condor_history with job_ids >= first_id (only the ones of cluster_ids, if given). The output
+    is parsed job by job, while it's read from the SSH-channel, so the whole history is never held in memory.
+    """
+    stdin, stdout, stderr = client.exec_command("condor_history -backwards -json -since {i}"
+                                                .format(i=int(first_id)-1))
+
+    # The output is a JSON-list with one attribute per line. A job can only be complete after a line starting
+    # with "}", so only then its buffered lines are tried to be decoded. Decoding fails, if the "}" closed just
+    # a nested object.
+    loads = orjson.loads if orjson is not None else json.loads
+    buffer = ""
+    for line in stdout:
+        if buffer == "":
+            line = line.lstrip(" \t\r\n[,]")
+            if line == "":
+                continue
+        buffer += line
+        if not line.lstrip().startswith("}"):
+            continue
+        try:
+            job = loads(buffer.rstrip(" \t\r\n,]"))
+        except ValueError:
+            continue
+        buffer = ""
+
+        if cluster_ids is None or str(job.get("ClusterId")) in cluster_ids:
+            yield _parse_history_job(job)
 
     error = ""
     for err in stderr:
@@ -80,17 +308,16 @@ def get_condor_history(client: paramiko.SSHClient, first_id: float, last_id: flo
     if error != "":
         raise ValueError("An error with condor_history occurred: {error}".format(error=error))
 
-    # Get output file
-    ftp_client = client.open_sftp()
-    ftp_client.get(output_filename, "results/"+output_filename)
-    ftp_client.close()
-    with open("results/"+output_filename) as json_file:
-        job_list = json.load(json_file)
+    # Output that isn't split into lines (e.g. of another HTCondor-version) is decoded at once
+    buffer = buffer.strip().rstrip("]").rstrip()
+    if buffer != "":
+        for job in loads("[" + buffer + "]"):
+            if cluster_ids is None or str(job.get("ClusterId")) in cluster_ids:
+                yield _parse_history_job(job)
+
 
-    result = {}
-    for job in job_list:
-        job["parsed_job_metrics"] = metrics.parse_condor_job_metrics(job)
-        job["id"] = job["GlobalJobId"]
-        result[job["id"]] = job
+def _parse_history_job(job: Dict) -> Dict:
+    job["parsed_job_metrics"] = metrics.parse_condor_job_metrics(job)
+    job["id"] = job["GlobalJobId"]
+    return job
 
-    return result
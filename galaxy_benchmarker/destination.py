@@ -7,21 +7,49 @@ import planemo_bridge
 import condor_bridge
 import metrics
 import logging
+import multiprocessing
+import sys
 import time
-from multiprocessing import Pool, TimeoutError
-from typing import Dict
-from task import BaseTask, AnsiblePlaybookTask, BenchmarkerTask
+from operator import itemgetter
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from typing import Dict, List, Union
+from task import BaseTask, AnsiblePlaybookTask
 from galaxy_bridge import Galaxy
 from bioblend.galaxy import GalaxyInstance
-from jinja2 import Template
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 # from workflow import GalaxyWorkflow, CondorWorkflow
 
 log = logging.getLogger("GalaxyBenchmarker")
 
+# Required config keys of the different destination types
+_pulsar_host_config = itemgetter("host", "host_user", "ssh_key", "tool_dependency_dir")
+_condor_config = itemgetter("name", "host", "host_user", "ssh_key", "jobs_directory_dir")
+
+# Destinations (and their params) that need to be added to Galaxy's job_conf.xml. Gets filled by
+# configure_destination, so create_galaxy_job_conf doesn't need to go through all destinations again.
+# The keys are the variables used in the job_conf.xml-template, so it can be rendered with it directly.
+_job_conf_registry: Dict[str, Union[List, Dict]] = {
+    "pulsar_destinations": list(),
+    "galaxy_condor_destinations": list(),
+    "job_plugin_params": dict(),
+    "job_destination_params": dict()
+}
+
+# Templates are compiled only once and then cached by the Environment, keyed on the mtime of the file (auto_reload),
+# so an edited template is picked up with a single stat. The compiled bytecode is also kept in the
+# temp-directory, so even the first render of a new process doesn't need to compile it.
+_template_env = Environment(loader=FileSystemLoader("galaxy_files"), auto_reload=True,
+                            bytecode_cache=FileSystemBytecodeCache())
+
 
 class BaseDestination:
+    __slots__ = ("name",)
+    # Which list of destinations in job_conf.xml this destination belongs to (see create_galaxy_job_conf)
+    _job_conf_bucket = None
+
     def __init__(self, name):
-        self.name = name
+        # Names are used as dict-keys all over the place (job_conf params, results), so intern them
+        self.name = sys.intern(name)
 
     def run_workflow(self, workflow: BaseWorkflow) -> Dict:
         """
@@ -34,10 +62,8 @@ class BaseDestination:
         """
         Runs a given task on the Destination.
         """
-        if task is None:
-            return
-        if type(task) is AnsiblePlaybookTask:
-            self.run_ansible_playbook_task(task)
+        if task is not None:
+            task.run_on_destination(self)
 
     def run_ansible_playbook_task(self, task: AnsiblePlaybookTask):
         raise NotImplementedError
@@ -49,17 +75,17 @@ class BaseDestination:
 
 
 class GalaxyDestination(BaseDestination):
-    host = ""
-    host_user = ""
-    ssh_key = ""
-    tool_dependency_dir = "/data/share/tools"
-    jobs_directory_dir = "/data/share/staging"
-    persistence_dir = "/data/share/persisted_data"
-    galaxy_user_name = ""
-    galaxy_user_key = ""
+    __slots__ = ("galaxy", "galaxy_user_name", "galaxy_user_key", "host", "host_user", "ssh_key",
+                 "tool_dependency_dir", "jobs_directory_dir", "persistence_dir")
 
     def __init__(self, name, glx: Galaxy, galaxy_user_name=None, galaxy_user_key=None):
         super().__init__(name)
+        self.host = ""
+        self.host_user = ""
+        self.ssh_key = ""
+        self.tool_dependency_dir = "/data/share/tools"
+        self.jobs_directory_dir = "/data/share/staging"
+        self.persistence_dir = "/data/share/persisted_data"
         self.galaxy = glx
         self.galaxy_user_name = galaxy_user_name
         self.galaxy_user_key = galaxy_user_key
@@ -72,7 +98,7 @@ class GalaxyDestination(BaseDestination):
         Creates a user specifically for this Destination-Instance. This one is later used for routing the jobs
         to the right Pulsar-Server.
         """
-        self.galaxy_user_name = str.lower("dest_user_" + self.name)
+        self.galaxy_user_name = sys.intern(("dest_user_" + self.name).lower())
         _, self.galaxy_user_key = glx.create_user(self.galaxy_user_name)
 
     def run_ansible_playbook_task(self, task: AnsiblePlaybookTask):
@@ -84,43 +110,55 @@ class GalaxyDestination(BaseDestination):
                                      "jobs_directory_dir": self.jobs_directory_dir,
                                      "persistence_dir": self.persistence_dir})
 
-    def get_jobs(self, history_name) -> Dict:
+    def get_jobs(self, history_name, fanout=16, history_id=None) -> Dict:
         """
-        Get all jobs together with their details from a given history_name.
+        Get all jobs together with their details from a given history_name. If the history_id is already
+        known, the history doesn't need to be looked up by its name. The details and metrics are
+        requested in parallel by up to fanout threads.
         """
-        glx_instance = self.galaxy.impersonate(user_key=self.galaxy_user_key)
-        job_ids = get_job_ids_from_history_name(history_name, glx_instance)
+        # Galaxy caches the impersonated instance per user_key
+        impersonated_instance = self.galaxy.impersonate(user_key=self.galaxy_user_key)
+        if history_id is not None:
+            job_ids = get_job_ids_from_history_id(history_id, impersonated_instance)
+        else:
+            job_ids = get_job_ids_from_history_name(history_name, impersonated_instance)
 
-        infos = dict()
-        for job_id in job_ids:
-            infos[job_id] = self.galaxy.instance.jobs.show_job(job_id, full_details=True)
+        if len(job_ids) == 0:
+            return dict()
 
-            # Get JobMetrics and parse them for future usage in influxDB
-            infos[job_id]["job_metrics"] = self.galaxy.instance.jobs.get_metrics(job_id)
-            infos[job_id]["parsed_job_metrics"] = metrics.parse_galaxy_job_metrics(infos[job_id]["job_metrics"])
+        jobs = self.galaxy.instance.jobs
+        with ThreadPoolExecutor(max_workers=min(fanout, 2 * len(job_ids))) as executor:
+            details = {job_id: executor.submit(jobs.show_job, job_id, full_details=True) for job_id in job_ids}
+            # Only jobs in state "ok" are returned for the history, so the metrics can already be requested
+            # together with the details
+            job_metrics = {job_id: executor.submit(jobs.get_metrics, job_id) for job_id in job_ids}
 
-        return infos
+            return {job_id: _add_job_metrics(details[job_id].result(), job_metrics[job_id].result())
+                    for job_id in job_ids}
 
     def run_workflow(self, workflow: GalaxyWorkflow) -> Dict:
         """
         Runs the given workflow on PulsarMQDestination. Returns Dict of the status and
         history_name of the finished workflow.
         """
-        log.info("Running workflow '{wf_name}' using Planemo".format(wf_name=workflow.name))
+        log.info("Running workflow '%s' using Planemo", workflow.name)
 
         start_time = time.monotonic()
 
         if workflow.timeout is None:
             result = planemo_bridge.run_planemo(self.galaxy, self, workflow.path)
         else:
-            # Run inside a Process to enable timeout
-            pool = Pool(processes=1)
-            pool_result = pool.apply_async(planemo_bridge.run_planemo, (self.galaxy, self, workflow.path))
-
+            # Import Planemo only once here, instead of in every forked process
+            planemo_bridge.load_planemo()
             try:
-                result = pool_result.get(timeout=workflow.timeout)
+                result = _run_with_timeout(planemo_bridge.run_planemo, (self.galaxy, self, workflow.path),
+                                           workflow.timeout)
             except TimeoutError:
-                log.info("Timeout after {timeout} seconds".format(timeout=workflow.timeout))
+                log.info("Timeout after %s seconds", workflow.timeout)
+                result = {"status": "error"}
+            except ChildProcessError as e:
+                # E.g. killed by the OOM-killer. Handled like a timeout, so the run can be retried
+                log.error("%s", e)
                 result = {"status": "error"}
 
         result["total_workflow_runtime"] = time.monotonic() - start_time
@@ -129,6 +167,9 @@ class GalaxyDestination(BaseDestination):
 
 
 class PulsarMQDestination(GalaxyDestination):
+    __slots__ = ("amqp_url", "job_plugin_params", "job_destination_params")
+    _job_conf_bucket = "pulsar_destinations"
+
     def __init__(self, name, glx: Galaxy, job_plugin_params: Dict, job_destination_params: Dict, amqp_url="", galaxy_user_name="", galaxy_user_key=""):
         self.amqp_url = amqp_url
         self.job_plugin_params = job_plugin_params
@@ -137,6 +178,9 @@ class PulsarMQDestination(GalaxyDestination):
 
 
 class GalaxyCondorDestination(GalaxyDestination):
+    __slots__ = ("job_plugin_params", "job_destination_params")
+    _job_conf_bucket = "galaxy_condor_destinations"
+
     def __init__(self, name, glx: Galaxy, job_plugin_params: Dict, job_destination_params: Dict, galaxy_user_name="", galaxy_user_key=""):
         self.job_plugin_params = job_plugin_params
         self.job_destination_params = job_destination_params
@@ -144,10 +188,14 @@ class GalaxyCondorDestination(GalaxyDestination):
 
 
 class CondorDestination(BaseDestination):
-    status_refresh_time = 0.5 # TODO: Figure out, if that timing is to fast
+    __slots__ = ("host", "host_user", "ssh_key", "jobs_directory_dir", "status_refresh_time",
+                 "status_refresh_time_max")
 
     def __init__(self, name, host, host_user, ssh_key, jobs_directory_dir):
         super().__init__(name)
+        # Bounds (in seconds) of the interval, in which the status of a running workflow is checked
+        self.status_refresh_time = 0.5  # TODO: Figure out, if that timing is to fast
+        self.status_refresh_time_max = 30
         self.host = host
         self.host_user = host_user
         self.ssh_key = ssh_key
@@ -157,7 +205,7 @@ class CondorDestination(BaseDestination):
         """
         Deploys the given workflow to the Condor-Server with Ansible.
         """
-        log.info("Deploying {workflow} to {destination}".format(workflow=workflow.name, destination=self.name))
+        log.info("Deploying %s to %s", workflow.name, self.name)
         # Use ansible-playbook to upload *.job-file to Condor-Manager
         values = {
             "jobs_directory_dir": self.jobs_directory_dir,
@@ -171,34 +219,37 @@ class CondorDestination(BaseDestination):
         """
         Runs the given workflow on CondorDestination. Returns Dict of ...
         """
-        ssh_client = condor_bridge.get_paramiko_client(self.host, self.host_user, self.ssh_key)
-
         remote_workflow_dir = "{jobs_dir}/{wf_name}".format(jobs_dir=self.jobs_directory_dir,
                                                             wf_name=workflow.name)
 
-        log.info("Submitting workflow '{wf}' to '{dest}'".format(wf=workflow, dest=self))
+        log.info("Submitting workflow '%s' to '%s'", workflow, self)
         start_time = time.monotonic()
-        job_ids = condor_bridge.submit_job(ssh_client, remote_workflow_dir, workflow.job_file)
+        # The SSH-connection is shared with all other runs on the same host (see condor_bridge.SSHConnectionPool)
+        with condor_bridge.ssh_session(self.host, self.host_user, self.ssh_key) as ssh_client:
+            job_ids = condor_bridge.submit_job(ssh_client, remote_workflow_dir, workflow.job_file)
         submit_time = time.monotonic() - start_time
-        log.info("Submitted in {seconds} seconds".format(seconds=submit_time))
-
-        # Check every 0.1s if status has changed
-        status = "unknown"
-        while status != "done":
-            try:
-                job_status = condor_bridge.get_job_status(ssh_client, job_ids["id"])
-            except ValueError as error:
-                status = "error"
-                log.error("There was an error with run of {workflow}: {error}".format(workflow=self.name,
-                                                                                      error=error))
-                break
-            status = job_status["status"]
-            time.sleep(self.status_refresh_time)
+        log.info("Submitted in %s seconds", submit_time)
+
+        # Status is checked together with the other running workflows, backing off for long-running ones. If
+        # the runtime of the workflow is known, the first interval is 1% of it.
+        refresh_time = self.status_refresh_time
+        if workflow.expected_runtime is not None:
+            refresh_time = max(self.status_refresh_time,
+                               min(workflow.expected_runtime / 100, self.status_refresh_time_max))
+        job_id = job_ids["id"]
+        try:
+            status = condor_bridge.get_status_poller(self.host, self.host_user, self.ssh_key, refresh_time,
+                                                     self.status_refresh_time_max).wait_until_done(job_id)
+        except ValueError as error:
+            status = "error"
+            log.error("There was an error with run of %s: %s", self.name, error)
 
         total_workflow_runtime = time.monotonic() - start_time
 
+        # The history is fetched together with the one of the other workflows that finished meanwhile
         log.info("Fetching condor_history")
-        jobs = condor_bridge.get_condor_history(ssh_client, float(job_ids["id"]), float(job_ids["id"]))
+        jobs = condor_bridge.get_history_fetcher(self.host, self.host_user, self.ssh_key,
+                                                 self.status_refresh_time).wait(job_id)
 
         result = {
             "id": job_ids["id"],
@@ -209,11 +260,103 @@ class CondorDestination(BaseDestination):
             "jobs": jobs
         }
 
-        ssh_client.close()
-
         return result
 
 
+def _add_job_metrics(info: Dict, job_metrics: List) -> Dict:
+    """
+    Adds the metrics of a job and their parsed version (for future usage in influxDB) to its details.
+    """
+    info["job_metrics"] = job_metrics
+    info["parsed_job_metrics"] = metrics.parse_galaxy_job_metrics(job_metrics)
+
+    return info
+
+
+# Forked processes get the already imported modules and don't need to pickle the arguments
+_fork_context = multiprocessing.get_context("fork")
+
+
+def _run_with_timeout(func, args, timeout):
+    """
+    Runs func inside a forked process and returns its result. If it doesn't finish within timeout seconds, the
+    process is terminated (so e.g. Planemo stops polling Galaxy) and TimeoutError is raised. Raises
+    ChildProcessError, if the process dies without returning a result.
+    """
+    receiver, sender = _fork_context.Pipe(duplex=False)
+
+    def run():
+        receiver.close()
+        try:
+            sender.send((True, func(*args)))
+        except BaseException as e:
+            sender.send((False, e))
+
+    # A new process per run on purpose: a timed-out run has to be killed, and killing a worker of a shared
+    # ProcessPoolExecutor would break the whole pool (BrokenProcessPool)
+    process = _fork_context.Process(target=run, daemon=True)
+    process.start()
+    sender.close()
+
+    try:
+        if not receiver.poll(timeout):
+            process.terminate()
+            raise TimeoutError()
+        try:
+            success, result = receiver.recv()
+        except EOFError:
+            process.join()
+            raise ChildProcessError("Process running {func} exited with code {code} without returning a result"
+                                    .format(func=func.__name__, code=process.exitcode))
+    finally:
+        receiver.close()
+        process.join()
+
+    if not success:
+        raise result
+    return result
+
+
+def _build_galaxy_destination(dest_config, glx) -> GalaxyDestination:
+    return GalaxyDestination(dest_config["name"], glx, dest_config.get("galaxy_user_name"),
+                             dest_config.get("galaxy_user_key"))
+
+
+def _build_pulsar_mq_destination(dest_config, glx) -> PulsarMQDestination:
+    destination = PulsarMQDestination(dest_config["name"], glx, dest_config.get("job_plugin_params", {}),
+                                      dest_config.get("job_destination_params", {}), dest_config["amqp_url"],
+                                      dest_config.get("galaxy_user_name"), dest_config.get("galaxy_user_key"))
+    if "host" in dest_config:
+        (destination.host, destination.host_user, destination.ssh_key,
+         destination.tool_dependency_dir) = _pulsar_host_config(dest_config)
+
+    return destination
+
+
+def _build_condor_destination(dest_config, glx) -> CondorDestination:
+    destination = CondorDestination(*_condor_config(dest_config))
+    destination.status_refresh_time = dest_config.get("status_refresh_time", destination.status_refresh_time)
+    destination.status_refresh_time_max = dest_config.get("status_refresh_time_max",
+                                                          destination.status_refresh_time_max)
+
+    return destination
+
+
+def _build_galaxy_condor_destination(dest_config, glx) -> GalaxyCondorDestination:
+    return GalaxyCondorDestination(dest_config["name"], glx, dest_config.get("job_plugin_params", {}),
+                                   dest_config.get("job_destination_params", {}),
+                                   dest_config.get("galaxy_user_name"), dest_config.get("galaxy_user_key"))
+
+
+# Builds the destination for each valid destination type
+_destination_builders = {
+    "Galaxy": _build_galaxy_destination,
+    "PulsarMQ": _build_pulsar_mq_destination,
+    "Condor": _build_condor_destination,
+    "GalaxyCondor": _build_galaxy_condor_destination
+}
+
+
 def configure_destination(dest_config, glx):
     """
     Initializes and configures a Destination according to the given configuration. Returns the configured Destination.
@@ -223,72 +366,33 @@ def configure_destination(dest_config, glx):
         raise ValueError("No Destination-Name set! Config: '{config}'".format(config=dest_config))
     if "type" not in dest_config:
         raise ValueError("No Destination-Type set for '{dest}'".format(dest=dest_config["name"]))
-    if dest_config["type"] not in ["Galaxy", "PulsarMQ", "Condor", "GalaxyCondor"]:
+    build_destination = _destination_builders.get(dest_config["type"])
+    if build_destination is None:
         raise ValueError("Destination-Type '{type}' not valid".format(type=dest_config["type"]))
 
-    job_plugin_params = dict() if "job_plugin_params" not in dest_config else dest_config["job_plugin_params"]
-    job_destination_params = dict() if "job_destination_params" not in dest_config else dest_config["job_destination_params"]
+    destination = build_destination(dest_config, glx)
 
-    galaxy_user_name = None if "galaxy_user_name" not in dest_config else dest_config["galaxy_user_name"]
-    galaxy_user_key = None if "galaxy_user_key" not in dest_config else dest_config["galaxy_user_key"]
-
-    if dest_config["type"] == "Galaxy":
-        destination = GalaxyDestination(dest_config["name"], glx, galaxy_user_name, galaxy_user_key)
-
-    if dest_config["type"] == "PulsarMQ":
-        destination = PulsarMQDestination(dest_config["name"], glx, job_plugin_params, job_destination_params,
-                                          dest_config["amqp_url"],
-                                          galaxy_user_name, galaxy_user_key)
-        if "host" in dest_config:
-            destination.host = dest_config["host"]
-            destination.host_user = dest_config["host_user"]
-            destination.ssh_key = dest_config["ssh_key"]
-            destination.tool_dependency_dir = dest_config["tool_dependency_dir"]
-
-    if dest_config["type"] == "Condor":
-        destination = CondorDestination(dest_config["name"], dest_config["host"], dest_config["host_user"],
-                                        dest_config["ssh_key"], dest_config["jobs_directory_dir"])
-        if "status_refresh_time" in dest_config:
-            destination.status_refresh_time = dest_config["status_refresh_time"]
-
-    if dest_config["type"] == "GalaxyCondor":
-        destination = GalaxyCondorDestination(dest_config["name"], glx, job_plugin_params, job_destination_params,
-                                              galaxy_user_name,
-                                              galaxy_user_key)
+    if destination._job_conf_bucket is not None:
+        _job_conf_registry[destination._job_conf_bucket].append(destination)
+        _job_conf_registry["job_plugin_params"][destination.name] = destination.job_plugin_params
+        _job_conf_registry["job_destination_params"][destination.name] = destination.job_destination_params
 
     return destination
 
 
-def create_galaxy_job_conf(glx: Galaxy, destinations: Dict[str, BaseDestination]):
+def create_galaxy_job_conf(glx: Galaxy):
     """
-    Creates the job_conf.xml-file for Galaxy using the given Dict (key: dest_name, value dest) and saves it to
-    galaxy_files/job_conf.xml.tmp.
+    Creates the job_conf.xml-file for Galaxy using all the Destinations set up with configure_destination and
+    saves it to galaxy_files/job_conf.xml.tmp.
     """
-    with open('galaxy_files/job_conf.xml') as file_:
-        template = Template(file_.read())
-
-    pulsar_destinations = list()
-    galaxy_condor_destinations = list()
-    job_plugin_params = dict()
-    job_destination_params = dict()
-
-    for dest in destinations.values():
-        if type(dest) is PulsarMQDestination:
-            pulsar_destinations.append(dest)
-        if type(dest) is GalaxyCondorDestination:
-            galaxy_condor_destinations.append(dest)
-        if issubclass(type(dest), PulsarMQDestination) or issubclass(type(dest), GalaxyCondorDestination):
-            job_plugin_params[dest.name] = dest.job_plugin_params
-            job_destination_params[dest.name] = dest.job_destination_params
+    template = _template_env.get_template("job_conf.xml")
 
-    job_conf = template.render(galaxy=glx,
-                               pulsar_destinations=pulsar_destinations,
-                               galaxy_condor_destinations=galaxy_condor_destinations,
-                               job_plugin_params=job_plugin_params,
-                               job_destination_params=job_destination_params)
-
-    with open("galaxy_files/job_conf.xml.tmp", "w") as fh:
-        fh.write(job_conf)
+    # Render chunk by chunk directly into the file instead of building the whole job_conf in memory first
+    with open("galaxy_files/job_conf.xml.tmp", "w", buffering=65536) as fh:
+        stream = template.stream(galaxy=glx, **_job_conf_registry)
+        # Join a few of the small rendered fragments before each write
+        stream.enable_buffering(size=5)
+        stream.dump(fh)
 
 
 def get_job_ids_from_history_name(history_name, impersonated_instance: GalaxyInstance):
@@ -299,14 +403,22 @@ def get_job_ids_from_history_name(history_name, impersonated_instance: GalaxyIns
     histories = impersonated_instance.histories.get_histories(name=history_name)
 
     if len(histories) >= 1:
-        history_id = histories[0]["id"]
-        dataset_ids = impersonated_instance.histories.show_history(history_id)["state_ids"]["ok"]
-        job_ids = list()
+        return get_job_ids_from_history_id(histories[0]["id"], impersonated_instance)
 
-        for dataset_id in dataset_ids:
-            job_ids.append(impersonated_instance.histories.show_dataset(history_id, dataset_id)["creating_job"])
+    return []
 
-        return job_ids
 
-    return []
+def get_job_ids_from_history_id(history_id, impersonated_instance: GalaxyInstance, page_size=500):
+    """
+    Returns the ids of all successful jobs of the history with the given history_id.
+    """
+    # Get the successful jobs of the history page by page (instead of one request per dataset), as Galaxy
+    # returns at most limit jobs per request. A page shorter than page_size is the last one.
+    job_ids = []
+    while True:
+        jobs = impersonated_instance.jobs.get_jobs(history_id=history_id, state="ok", limit=page_size,
+                                                   offset=len(job_ids))
+        job_ids.extend(job["id"] for job in jobs)
+        if len(jobs) < page_size:
+            return job_ids
 
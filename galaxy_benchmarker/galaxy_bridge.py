@@ -1,15 +1,45 @@
 from bioblend.galaxy import GalaxyInstance
-from typing import Tuple, List
+from requests.adapters import HTTPAdapter
+from typing import Dict, Tuple, List
 from workflow import BaseWorkflow, GalaxyWorkflow
 import ansible_bridge
 import planemo_bridge
 import logging
-import string
-import random
+import secrets
 import re
+import requests
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 log = logging.getLogger("GalaxyBenchmarker")
 
+# Matches the hostname (second group) of a URL
+_url_host_pattern = re.compile(r"^[a-z][a-z0-9+\-.]*://([a-z0-9\-._~%!$&'()*+,;=]+@)?([a-z0-9\-._~%]+|\[[a-z0-9\-."
+                               r"_~%!$&'()*+,;=:]+\])")
+
+
+# One Session for the GET-requests of all GalaxyInstances, so connections are kept alive and reused
+_session = requests.Session()
+_session.mount("http://", HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=20))
+_session.mount("https://", HTTPAdapter(pool_connections=16, pool_maxsize=64, max_retries=20))
+
+
+class _GalaxyInstance(GalaxyInstance):
+    """
+    GalaxyInstance that sends its GET-requests through the shared _session. If orjson is installed, the
+    (potentially large) JSON responses are decoded with it instead of the stdlib json.
+    """
+    def make_get_request(self, url, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        kwargs.setdefault("verify", self.verify)
+        response = _session.get(url, headers=self.json_headers, **kwargs)
+        if orjson is not None:
+            response.json = lambda **_: orjson.loads(response.content)
+        return response
+
 
 class Galaxy:
     def __init__(self, url, user_key, shed_install=False,
@@ -25,7 +55,11 @@ class Galaxy:
         self.galaxy_config_dir = galaxy_config_dir
         self.galaxy_user = galaxy_user
 
-        self.instance = GalaxyInstance(url, key=user_key)
+        self.instance = _GalaxyInstance(url, key=user_key)
+        # Already created/fetched users. key: username, value: (user_id, user_key)
+        self._user_cache: Dict[str, Tuple] = dict()
+        # Already impersonated GalaxyInstances. key: user_key
+        self._impersonated: Dict[str, GalaxyInstance] = dict()
 
     def impersonate(self, user=None, user_key=None) -> GalaxyInstance:
         """
@@ -35,24 +69,36 @@ class Galaxy:
         if user is not None:
             user_id = self.instance.users.get_users(f_name=user)[0]["id"]
             user_key = self.instance.users.get_user_apikey(user_id)
-        return GalaxyInstance(self.url, key=user_key)
+
+        if user_key not in self._impersonated:
+            self._impersonated[user_key] = _GalaxyInstance(self.url, key=user_key)
+        return self._impersonated[user_key]
 
     def create_user(self, username) -> Tuple:
         """
         Creates a new user (if not already created) with username and a random password and returns
         its user_id and api_key as a tuple.
         """
-        if len(self.instance.users.get_users(f_name=username)) == 0:
-            password = ''.join([random.choice(string.ascii_letters + string.digits) for _ in range(32)])
-            self.instance.users.create_local_user(username,
-                                                  "{username}@galaxy.uni.andreas-sk.de".format(username=username),
-                                                  password)
+        if username in self._user_cache:
+            return self._user_cache[username]
+
+        users = self.instance.users.get_users(f_name=username)
+        if len(users) == 0:
+            password = secrets.token_urlsafe(24)
+            user_id = self.instance.users.create_local_user(username,
+                                                            "{username}@galaxy.uni.andreas-sk.de"
+                                                            .format(username=username),
+                                                            password)["id"]
+            # A new user has no api key yet
+            user_key = self.instance.users.create_user_apikey(user_id)
+        else:
+            user_id = users[0]["id"]
+            user_key = self.instance.users.get_user_apikey(user_id)
 
-        user_id = self.instance.users.get_users(f_name=username)[0]["id"]
-        user_key = self.instance.users.get_user_apikey(user_id)
+            if user_key == "Not available.":
+                user_key = self.instance.users.create_user_apikey(user_id)
 
-        if user_key == "Not available.":
-            user_key = self.instance.users.create_user_apikey(user_id)
+        self._user_cache[username] = (user_id, user_key)
 
         return user_id, user_key
 
@@ -78,8 +124,7 @@ class Galaxy:
         Deploys the job_conf.xml-file to the Galaxy-Server.
         """
         # Hostname parsed from the Galaxy-URL
-        host = re.findall("^[a-z][a-z0-9+\-.]*://([a-z0-9\-._~%!$&'()*+,;=]+@)?([a-z0-9\-._~%]+|\[[a-z0-9\-."
-                          + "_~%!$&'()*+,;=:]+\])", self.url)[0][1]
+        host = _url_host_pattern.match(self.url).group(2)
 
         if None in (self.ssh_user, self.ssh_key, self.galaxy_root_path, self.galaxy_config_dir, self.galaxy_user):
             raise ValueError("ssh_user, ssh_key, galaxy_root_path, galaxy_config_dir, and galaxy_user need "
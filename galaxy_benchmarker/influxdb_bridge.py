@@ -1,60 +1,163 @@
 from influxdb import InfluxDBClient
-from typing import Dict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List
+import threading
+import time
 
 
 class InfluxDB:
+    batch_size = 5000
+    # Number of batches that are sent to InfluxDB at the same time
+    writer_threads = 4
+
     def __init__(self, host, port, username, password, db_name):
         self.client = InfluxDBClient(host=host, port=port, username=username, password=password,
                                      ssl=False, database=db_name, retries=20)
+        # Metrics are collected here (in line protocol) and written in batches (see flush)
+        self._pending_lines: List[str] = list()
+        # Points are sent by background threads, so the benchmarker doesn't need to wait for InfluxDB. The
+        # executor queues the batches, so they are written in parallel while the next ones are collected
+        self._writer = ThreadPoolExecutor(max_workers=self.writer_threads)
+        self._writes: List[Future] = list()
+        # Last timestamp handed out by _next_timestamp
+        self._last_timestamp = 0
+        self._timestamp_lock = threading.Lock()
 
-    def save_job_metrics(self, tags: Dict, job_results: Dict):
+    def _next_timestamp(self) -> int:
         """
-        Saves the parsed job-specific metrics (see metrics.py) to InfluxDB.
+        Returns the current time in ns, but always later than the last returned one. Each job and each
+        workflow-run gets its own timestamp, as InfluxDB would otherwise give all points of a request the
+        same one and points with the same measurement and tags would overwrite each other.
         """
-        if "parsed_job_metrics" not in job_results:
-            return []
+        with self._timestamp_lock:
+            self._last_timestamp = max(time.time_ns(), self._last_timestamp + 1)
+            return self._last_timestamp
 
-        json_points = []
+    def _write(self, lines: List[str]):
+        """
+        Hands the lines over to the background writer and returns immediately.
+        """
+        self._writes.append(self._writer.submit(self.client.write_points, lines, time_precision="n",
+                                                batch_size=self.batch_size, protocol="line"))
 
-        for metric in job_results["parsed_job_metrics"].values():
-            metric_tags = tags.copy()
+    def flush(self):
+        """
+        Sends all pending lines to InfluxDB (in the background, see wait_for_writes).
+        """
+        if len(self._pending_lines) == 0:
+            return
 
-            if "job_id" in job_results:
-                metric_tags["job_id"] = job_results["id"]
-            if "tool_id" in job_results:
-                metric_tags["tool_id"] = job_results["tool_id"]
+        self._write(self._pending_lines)
+        self._pending_lines = list()
 
-            if "plugin" in metric:
-                metric_tags["plugin"] = metric["plugin"]
+    def wait_for_writes(self):
+        """
+        Flushes the pending lines and blocks until all writes are done. Raises the error of a failed write.
+        """
+        self.flush()
+        writes, self._writes = self._writes, list()
+        for write in writes:
+            write.result()
 
-            json_points.append({
-                "measurement": metric["name"],
-                "tags": metric_tags,
-                "fields": {
-                    "value": metric["value"]
-                }
-            })
+    def _buffer(self, lines: List[str]):
+        """
+        Adds the lines to the pending lines and flushes them once batch_size is reached.
+        """
+        self._pending_lines.extend(lines)
+        if len(self._pending_lines) >= self.batch_size:
+            self.flush()
 
-        self.client.write_points(json_points)
+    def save_job_metrics_batch(self, tags: Dict, jobs: Iterable[Dict]):
+        """
+        Saves the parsed job-specific metrics (see metrics.py) of all the jobs of a workflow-run, sharing the
+        same tags, to InfluxDB. Each job gets its own timestamp (and job_id), so the jobs don't overwrite each
+        other. The points are only buffered and written once batch_size is reached or flush is called.
+        """
+        lines = list()
+        for job_results in jobs:
+            if "parsed_job_metrics" in job_results:
+                lines.extend(_job_metrics_to_lines(tags, job_results, self._next_timestamp()))
+
+        self._buffer(lines)
 
     def save_workflow_metrics(self, tags: Dict, metrics: Dict):
         """
-        Saves the workflow-specific metrics to InfluxDB.
+        Saves the workflow-specific metrics to InfluxDB. Like the job-metrics, they are buffered until
+        batch_size is reached or flush is called.
         """
-        json_points = []
+        self._buffer(_metrics_to_lines(metrics, tags, self._next_timestamp()))
+
+
+def _job_metrics_to_lines(tags: Dict, job_results: Dict, timestamp: int) -> List[str]:
+    """
+    Converts the parsed metrics of a job to InfluxDB-lines, tagged with the job_id and tool_id of the job.
+    All lines get the given timestamp (in ns).
+    """
+    # Tags shared by all metrics of the job. The job_id keeps the jobs of a run apart, e.g. the jobs of a
+    # Condor cluster or two jobs of the same tool
+    job_tags = tags.copy()
+    if "id" in job_results:
+        job_tags["job_id"] = job_results["id"]
+    if "tool_id" in job_results:
+        job_tags["tool_id"] = job_results["tool_id"]
+
+    return _metrics_to_lines(job_results["parsed_job_metrics"], job_tags, timestamp)
+
+
+def _metrics_to_lines(metrics: Dict, tags: Dict, timestamp: int) -> List[str]:
+    """
+    Converts the given metrics (see metrics.ParsedMetric) to InfluxDB line protocol with the given timestamp
+    (in ns). The same as the InfluxDBClient does for points, but the tags are escaped only once per plugin
+    instead of once per metric. Metrics without a value are skipped, like the client does.
+    """
+    timestamp = str(timestamp)
+    # key: plugin, value: escaped tags (with the plugin-tag)
+    tag_sets = dict()
+    lines = list()
+    for metric in metrics.values():
+        if metric.value is None:
+            continue
+        if metric.plugin not in tag_sets:
+            tag_sets[metric.plugin] = _tags_to_line(tags if metric.plugin is None
+                                                    else {**tags, "plugin": metric.plugin})
+        lines.append("{measurement}{tags} value={value} {timestamp}".format(
+            measurement=_escape_tag(metric.name), tags=tag_sets[metric.plugin], value=_field_value(metric.value),
+            timestamp=timestamp))
+
+    return lines
+
+
+def _tags_to_line(tags: Dict) -> str:
+    """
+    Returns the tags as the tag-part of a line (sorted by key, starting with ","). Empty tags are dropped.
+    """
+    line = ""
+    for key, value in sorted(tags.items()):
+        if value is None:
+            continue
+        value = _escape_tag(value)
+        if key == "" or value == "":
+            continue
+        # A trailing backslash would escape the following separator
+        if value.endswith("\\"):
+            value += " "
+        line += "," + _escape_tag(key) + "=" + value
+
+    return line
 
-        for metric in metrics.values():
-            metric_tags = tags.copy()
 
-            if "plugin" in metric:
-                metric_tags["plugin"] = metric["plugin"]
+def _escape_tag(tag) -> str:
+    return str(tag).replace("\\", "\\\\").replace(" ", "\\ ").replace(",", "\\,").replace("=", "\\=")\
+        .replace("\n", "\\n")
 
-            json_points.append({
-                "measurement": metric["name"],
-                "tags": metric_tags,
-                "fields": {
-                    "value": metric["value"]
-                }
-            })
 
-        self.client.write_points(json_points)
+def _field_value(value) -> str:
+    if isinstance(value, str):
+        return '"' + value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return str(value) + "i"
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
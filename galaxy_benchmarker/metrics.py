@@ -1,140 +1,161 @@
 from typing import List, Dict
 from datetime import datetime
 import logging
+import sys
 
 log = logging.getLogger("GalaxyBenchmarker")
 
-# All the metrics that can safely be parsed as a float_metric (see parse_galaxy_job_metrics)
-galaxy_float_metrics = {"processor_count", "memtotal", "swaptotal", "runtime_seconds", "memory.stat.pgmajfault",
-                        "cpu.stat.nr_throttled", "memory.stat.total_rss_huge", "memory.memsw.failcnt",
-                        "memory.oom_control.under_oom", "memory.kmem.failcnt", "memory.stat.total_pgfault",
-                        "cpu.stat.nr_periods", "cpuacct.stat.user", "memory.stat.active_file", "memory.stat.mapped_file",
-                         "memory.stat.rss_huge", "memory.memsw.limit_in_bytes", "memory.use_hierarchy", "memory.stat.cache",
-                        "memory.stat.hierarchical_memsw_limit", "memory.kmem.tcp.failcnt", "cpu.rt_runtime_us",
-                        "memory.stat.hierarchical_memory_limit", "memory.stat.total_cache", "memory.kmem.max_usage_in_bytes",
-                        "cpuacct.usage", "memory.stat.total_pgmajfault", "memory.kmem.usage_in_bytes",
-                        "memory.stat.inactive_file", "memory.swappiness", "memory.move_charge_at_immigrate",
-                        "memory.memsw.usage_in_bytes", "cpu.rt_period_us", "memory.stat.inactive_anon", "memory.stat.swap",
-                        "memory.stat.active_anon", "memory.stat.pgpgin", "memory.stat.total_inactive_file",
-                        "memory.oom_control.oom_kill_disable", "memory.stat.total_pgpgout", "memory.stat.total_unevictable",
-                        "memory.kmem.tcp.limit_in_bytes", "memory.stat.pgpgout", "memory.usage_in_bytes",
-                        "memory.failcnt", "memory.memsw.max_usage_in_bytes", "memory.limit_in_bytes",
-                        "memory.soft_limit_in_bytes", "memory.kmem.tcp.max_usage_in_bytes", "memory.stat.total_rss",
-                        "cpu.shares", "memory.stat.total_swap", "memory.stat.rss", "memory.kmem.tcp.usage_in_bytes",
-                        "cpu.stat.throttled_time", "memory.stat.unevictable", "memory.kmem.limit_in_bytes",
-                        "cpu.cfs_quota_us", "cpuacct.stat.system", "memory.stat.total_active_anon",
-                        "memory.max_usage_in_bytes", "memory.stat.total_active_file", "memory.stat.total_mapped_file",
-                        "cpu.cfs_period_us", "memory.stat.pgfault", "memory.stat.total_pgpgin",
-                        "memory.stat.total_inactive_anon", "preprocessing_time", "tool_preparation_time",
-                        "down_collection_time"}
-galaxy_string_metrics = {"cpuacct.usage_percpu"}
-condor_float_metrics = {"NumRestarts", "NumJobRestarts", "JobStatus"}
-condor_string_metrics = {"LastRemoteHost", "GlobalJobId", "Cmd"}
-condor_time_metrics = {"JobStartDate", "JobCurrentStartDate", "CompletionDate"}
-
-
-def parse_galaxy_job_metrics(job_metrics: List) -> Dict[str, Dict]:
+# All the metrics that can safely be parsed as a float_metric (see parse_galaxy_job_metrics). The names are
+# interned, so looking up the (also interned) names of the job metrics mostly just compares pointers
+galaxy_float_metrics = frozenset(map(sys.intern, {
+    "processor_count", "memtotal", "swaptotal", "runtime_seconds", "memory.stat.pgmajfault",
+    "cpu.stat.nr_throttled", "memory.stat.total_rss_huge", "memory.memsw.failcnt", "memory.oom_control.under_oom",
+    "memory.kmem.failcnt", "memory.stat.total_pgfault", "cpu.stat.nr_periods", "cpuacct.stat.user",
+    "memory.stat.active_file", "memory.stat.mapped_file", "memory.stat.rss_huge", "memory.memsw.limit_in_bytes",
+    "memory.use_hierarchy", "memory.stat.cache", "memory.stat.hierarchical_memsw_limit", "memory.kmem.tcp.failcnt",
+    "cpu.rt_runtime_us", "memory.stat.hierarchical_memory_limit", "memory.stat.total_cache",
+    "memory.kmem.max_usage_in_bytes", "cpuacct.usage", "memory.stat.total_pgmajfault", "memory.kmem.usage_in_bytes",
+    "memory.stat.inactive_file", "memory.swappiness", "memory.move_charge_at_immigrate",
+    "memory.memsw.usage_in_bytes", "cpu.rt_period_us", "memory.stat.inactive_anon", "memory.stat.swap",
+    "memory.stat.active_anon", "memory.stat.pgpgin", "memory.stat.total_inactive_file",
+    "memory.oom_control.oom_kill_disable", "memory.stat.total_pgpgout", "memory.stat.total_unevictable",
+    "memory.kmem.tcp.limit_in_bytes", "memory.stat.pgpgout", "memory.usage_in_bytes", "memory.failcnt",
+    "memory.memsw.max_usage_in_bytes", "memory.limit_in_bytes", "memory.soft_limit_in_bytes",
+    "memory.kmem.tcp.max_usage_in_bytes", "memory.stat.total_rss", "cpu.shares", "memory.stat.total_swap",
+    "memory.stat.rss", "memory.kmem.tcp.usage_in_bytes", "cpu.stat.throttled_time", "memory.stat.unevictable",
+    "memory.kmem.limit_in_bytes", "cpu.cfs_quota_us", "cpuacct.stat.system", "memory.stat.total_active_anon",
+    "memory.max_usage_in_bytes", "memory.stat.total_active_file", "memory.stat.total_mapped_file",
+    "cpu.cfs_period_us", "memory.stat.pgfault", "memory.stat.total_pgpgin", "memory.stat.total_inactive_anon",
+    "preprocessing_time", "tool_preparation_time", "down_collection_time"
+}))
+galaxy_string_metrics = frozenset(map(sys.intern, {"cpuacct.usage_percpu"}))
+condor_float_metrics = frozenset({"NumRestarts", "NumJobRestarts", "JobStatus"})
+condor_string_metrics = frozenset({"LastRemoteHost", "GlobalJobId", "Cmd"})
+condor_time_metrics = frozenset({"JobStartDate", "JobCurrentStartDate", "CompletionDate"})
+# Meaning of the JobStatus-codes of Condor
+condor_job_status = {
+    1: "idle",
+    2: "running",
+    3: "removed",
+    4: "success",
+    5: "held",
+    6: "transferring output"
+}
+
+
+class ParsedMetric:
+    """
+    A single parsed metric, ready to be ingested by InfluxDB. Uses __slots__, as there are a lot of them
+    for every job.
+    """
+    __slots__ = ("name", "type", "plugin", "value")
+
+    def __init__(self, name, metric_type, plugin, value):
+        self.name = name
+        self.type = metric_type
+        self.plugin = plugin
+        self.value = value
+
+    def to_dict(self) -> Dict:
+        return {
+            "name": self.name,
+            "type": self.type,
+            "plugin": self.plugin,
+            "value": self.value
+        }
+
+    def __str__(self):
+        return str(self.to_dict())
+
+    __repr__ = __str__
+
+
+def _parse_float_metric(name, plugin, value) -> ParsedMetric:
+    return ParsedMetric(name, "float", plugin, float(value))
+
+
+def _parse_string_metric(name, plugin, value) -> ParsedMetric:
+    return ParsedMetric(name, "string", plugin, value)
+
+
+def _parse_timestamp_metric(name, plugin, value) -> ParsedMetric:
+    return ParsedMetric(name, "timestamp", plugin, value * 1000)
+
+
+# Parser for each metric that should be kept, so it can be determined with a single lookup
+galaxy_metric_parsers = {
+    **{name: _parse_float_metric for name in galaxy_float_metrics},
+    **{name: _parse_string_metric for name in galaxy_string_metrics}
+}
+condor_metric_parsers = {
+    **{name: _parse_float_metric for name in condor_float_metrics},
+    **{name: _parse_string_metric for name in condor_string_metrics},
+    **{name: _parse_timestamp_metric for name in condor_time_metrics}
+}
+
+
+def parse_galaxy_job_metrics(job_metrics: List) -> Dict[str, ParsedMetric]:
     """
     Parses the more or less "raw" metrics from Galaxy, so they can later be ingested by InfluxDB.
     """
-    parsed_metrics = {
-        "staging_time": {
-            "name": "staging_time",
-            "type": "float",
-            "value": float(0)
-        },
-    }
+    parsed_metrics = dict()
+
+    # Bind to local, as it's used for every single metric
+    metric_parsers = galaxy_metric_parsers
 
     jobstatus_queued = jobstatus_running = None
     for metric in job_metrics:
+        name = sys.intern(metric["name"])
+        # A single lookup decides, if and how the metric is kept. Everything else is only read for those
+        parse_metric = metric_parsers.get(name)
         try:
-            if metric["name"] in galaxy_float_metrics:
-                parsed_metrics[metric["name"]] = {
-                    "name": metric["name"],
-                    "type": "float",
-                    "plugin": metric["plugin"],
-                    "value": float(metric["raw_value"])
-                }
-            if metric["name"] in galaxy_string_metrics:
-                parsed_metrics[metric["name"]] = {
-                    "name": metric["name"],
-                    "type": "string",
-                    "plugin": metric["plugin"],
-                    "value": metric["raw_value"]
-                }
-            # For calculating the staging time (if the metrics exist)
-            if metric["plugin"] == "jobstatus" and metric["name"] == "queued":
-                jobstatus_queued = datetime.strptime(metric["value"], "%Y-%m-%d %H:%M:%S.%f")
-            if metric["plugin"] == "jobstatus" and metric["name"] == "running":
-                jobstatus_running = datetime.strptime(metric["value"], "%Y-%m-%d %H:%M:%S.%f")
+            if parse_metric is not None:
+                parsed_metrics[name] = parse_metric(name, metric["plugin"], metric.get("raw_value"))
+            # For calculating the staging time (if the metrics exist). Timestamps have the format
+            # "%Y-%m-%d %H:%M:%S.%f". fromisoformat is implemented in C and parses them a lot faster than
+            # strptime or slicing the string by hand.
+            elif metric["plugin"] == "jobstatus":
+                if name == "queued":
+                    jobstatus_queued = datetime.fromisoformat(metric["value"])
+                elif name == "running":
+                    jobstatus_running = datetime.fromisoformat(metric["value"])
         except ValueError as e:
             log.error("Error while trying to parse Galaxy job metrics '{name} = {value}': {error}. Ignoring.."
-                      .format(error=e, name=metric["name"], value=metric["raw_value"]))
+                      .format(error=e, name=name, value=metric.get("raw_value", metric.get("value"))))
 
-    # Calculate staging time
+    # Calculate staging time. Jobs without the jobstatus-metrics don't get one, instead of a staging time of 0
     if jobstatus_queued is not None and jobstatus_running is not None:
-        parsed_metrics["staging_time"]["value"] = float((jobstatus_running - jobstatus_queued).seconds +
-                                                        (jobstatus_running - jobstatus_queued).microseconds * 0.000001)
+        parsed_metrics["staging_time"] = ParsedMetric("staging_time", "float", None,
+                                                      (jobstatus_running - jobstatus_queued).total_seconds())
 
     return parsed_metrics
 
 
-def parse_condor_job_metrics(job_metrics: Dict) -> Dict[str, Dict]:
+def parse_condor_job_metrics(job_metrics: Dict) -> Dict[str, ParsedMetric]:
     parsed_metrics = {}
 
-    for key, value in job_metrics.items():
+    # A job of condor_history has a lot more attributes than the few metrics that are kept, so only look
+    # those up instead of going through all attributes
+    for key, parse_metric in condor_metric_parsers.items():
+        if key not in job_metrics:
+            continue
+        value = job_metrics[key]
         try:
-            if key in condor_float_metrics:
-                parsed_metrics[key] = {
-                    "name": key,
-                    "type": "float",
-                    "plugin": "condor_history",
-                    "value": float(value)
-                }
-            if key in condor_string_metrics:
-                parsed_metrics[key] = {
-                    "name": key,
-                    "type": "string",
-                    "plugin": "condor_history",
-                    "value": value
-                }
-            if key in condor_time_metrics:
-                parsed_metrics[key] = {
-                    "name": key,
-                    "type": "timestamp",
-                    "plugin": "condor_history",
-                    "value": value * 1000
-                }
-            if key == "JobStatus":
-                if value == 1:
-                    status = "idle"
-                elif value == 2:
-                    status = "running"
-                elif value == 3:
-                    status = "removed"
-                elif value == 4:
-                    status = "success"
-                elif value == 5:
-                    status = "held"
-                elif value == 6:
-                    status = "transferring output"
-                else:
-                    status = "unknown"
-                parsed_metrics["job_status"] = {
-                    "name": "job_status",
-                    "type": "string",
-                    "plugin": "condor_history",
-                    "value": status
-                }
-            if key == "RemoteWallClockTime":
-                parsed_metrics["runtime_seconds"] = {
-                    "name": "runtime_seconds",
-                    "type": "float",
-                    "plugin": "condor_history",
-                    "value": float(value)
-                }
+            parsed_metrics[key] = parse_metric(key, "condor_history", value)
         except ValueError as e:
             log.error("Error while trying to parse Condor job metrics '{key} = {value}': {error}. Ignoring.."
                       .format(error=e, key=key, value=value))
 
+    if "JobStatus" in job_metrics:
+        parsed_metrics["job_status"] = ParsedMetric("job_status", "string", "condor_history",
+                                                    condor_job_status.get(job_metrics["JobStatus"], "unknown"))
+
+    if "RemoteWallClockTime" in job_metrics:
+        try:
+            parsed_metrics["runtime_seconds"] = _parse_float_metric("runtime_seconds", "condor_history",
+                                                                    job_metrics["RemoteWallClockTime"])
+        except ValueError as e:
+            log.error("Error while trying to parse Condor job metrics '{key} = {value}': {error}. Ignoring.."
+                      .format(error=e, key="RemoteWallClockTime", value=job_metrics["RemoteWallClockTime"]))
+
     return parsed_metrics
@@ -1,30 +1,61 @@
 import novaclient.v2.servers
 import novaclient.client
-from typing import List
+from typing import Dict, List, Tuple
 import logging
+import re
+import time
 
 log = logging.getLogger("GalaxyBenchmarker")
 
 
 class OpenStackCompute:
     def __init__(self, auth_url, compute_endpoint_version, username, password,
-                 project_id, region_name, user_domain_name):
-        self.client = novaclient.client.Client(compute_endpoint_version, username=username, password=password,
-                                               project_id=project_id, auth_url=auth_url,
-                                               user_domain_name=user_domain_name, region_name=region_name)
+                 project_id, region_name, user_domain_name, servers_cache_ttl=30):
+        self._client_args = (compute_endpoint_version,)
+        self._client_kwargs = {"username": username, "password": password, "project_id": project_id,
+                               "auth_url": auth_url, "user_domain_name": user_domain_name,
+                               "region_name": region_name}
+        self._client = None
+        # Seconds, a server list is reused by get_servers, before it's requested again. The cache is dropped
+        # anyway, once a server is rebooted or rebuilt
+        self.servers_cache_ttl = servers_cache_ttl
+        # Cached server lists of get_servers. key: name_contains, value: (time fetched, servers)
+        self._servers: Dict[str, Tuple[float, List[novaclient.v2.servers.Server]]] = dict()
+
+    @property
+    def client(self):
+        """
+        Nova-client, created with the first request, so a benchmark that never runs an OpenStack task doesn't
+        need to set it up. Reused afterwards.
+        """
+        if self._client is None:
+            self._client = novaclient.client.Client(*self._client_args, **self._client_kwargs)
+        return self._client
+
+    def _invalidate_servers(self):
+        """
+        Drops the cached server lists, as the status of the servers changed.
+        """
+        self._servers.clear()
 
     def get_servers(self, name_contains="") -> List[novaclient.v2.servers.Server]:
         """
-        Returns all servers that contain name_contains in their name.
+        Returns all servers that contain name_contains in their name. The filtering is done by Nova (which
+        matches the name as a regex), so only the matching servers are transferred. The result is cached for
+        servers_cache_ttl seconds, so e.g. multiple tasks at the same time don't need to request it each.
         """
-        result = []
-        servers = self.client.servers.list()
+        cached = self._servers.get(name_contains)
+        if cached is not None and time.monotonic() - cached[0] <= self.servers_cache_ttl:
+            return cached[1]
 
-        for server in servers:
-            if server.name.find(name_contains) != -1:
-                result.append(server)
+        search_opts = {"name": re.escape(name_contains)} if name_contains != "" else None
+        # Nova's regex-match might be less strict (e.g. case-insensitive, depending on the database), so
+        # check the (few) returned names again. "in" does the substring-search in C.
+        servers = [server for server in self.client.servers.list(search_opts=search_opts)
+                   if name_contains in server.name]
+        self._servers[name_contains] = (time.monotonic(), servers)
 
-        return result
+        return servers
 
     def reboot_servers(self, servers: List[novaclient.v2.servers.Server], hard=False):
         """
@@ -36,6 +67,7 @@ class OpenStackCompute:
             if server.status == 'ACTIVE':
                 log.info("Rebooting server {name}".format(name=server.name))
                 server.reboot(reboot_type)
+                self._invalidate_servers()
 
     def rebuild_servers(self, servers: List[novaclient.v2.servers.Server]):
         """
@@ -46,3 +78,4 @@ class OpenStackCompute:
                 log.info("Rebuilding server {name}".format(name=server.name))
                 image = server.image["id"]
                 server.rebuild(image)
+                self._invalidate_servers()
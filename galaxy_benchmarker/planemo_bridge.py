@@ -2,67 +2,122 @@
 Bridge between Planemo and GalaxyBenchmarker
 """
 from __future__ import annotations
-import random
 import bioblend
-import time
 import logging
+import threading
 import urllib3
+import uuid
 from galaxy_bridge import Galaxy
 # from destination import PulsarMQDestination
-from planemo import options
-from planemo.cli import Context
-from planemo.engine import engine_context
-from planemo.galaxy.test import handle_reports_and_summary
-from planemo.runnable import for_paths
-from planemo.galaxy.workflows import install_shed_repos
 from typing import Dict
 
 log = logging.getLogger("GalaxyBenchmarker")
 
+# _cli decorated with Planemo's options (see _planemo_cli)
+_decorated_cli = None
+_decorated_cli_lock = threading.Lock()
+
 
 def run_planemo(glx: Galaxy, dest: PulsarMQDestination, workflow_path) -> Dict:
     """
-    Runs workflow with Planemo and returns a dict of the status and history_name of the finished workflow.
+    Runs workflow with Planemo and returns a dict of the status and history_name (and history_id, if Planemo
+    reported it) of the finished workflow.
     """
-    return _cli(Context(), [workflow_path], glx, dest.galaxy_user_key)
+    from planemo.cli import Context
+
+    return _planemo_cli()(Context(), [workflow_path], glx, dest.galaxy_user_key)
 
 
 def install_workflow(workflow_path, glx_instance):
     """
     Installs the tools necessary to run a given workflow (given as a path to the workflow).
     """
+    from planemo.runnable import for_paths
+    from planemo.galaxy.workflows import install_shed_repos
+
     runnable = for_paths(workflow_path)[0]
     install_shed_repos(runnable, glx_instance, False)
 
 
-@options.galaxy_target_options()
-@options.galaxy_config_options()
-@options.test_options()
-@options.engine_options()
+def load_planemo():
+    """
+    Imports Planemo ahead of the first run, e.g. so processes forked to run a workflow don't need to import it
+    again each.
+    """
+    _planemo_cli()
+
+
+def _planemo_cli():
+    """
+    Returns _cli, decorated with Planemo's options. Planemo is only imported (which takes a while) once the
+    first Galaxy workflow is run, so e.g. benchmarks with only Condor workflows don't need to load it at all.
+    The options are added to _cli itself, so this is done only once, even if the first runs start together.
+    """
+    global _decorated_cli
+
+    if _decorated_cli is not None:
+        return _decorated_cli
+
+    with _decorated_cli_lock:
+        if _decorated_cli is None:
+            from planemo import options
+
+            cli = _cli
+            for decorate in (options.engine_options(), options.test_options(), options.galaxy_config_options(),
+                             options.galaxy_target_options()):
+                cli = decorate(cli)
+            _decorated_cli = cli
+
+    return _decorated_cli
+
+
 def _cli(ctx, paths, glx, user_key, **kwds) -> Dict:
     """
-    Run specified tool's tests within Galaxy.
-    Returns a dict of the status and history_name of the finished workflow.
+    Run specified tool's tests within Galaxy. Needs to be called through _planemo_cli, so the options are set.
+    Returns a dict of the status, history_name and - if known - history_id of the finished workflow.
     See https://github.com/galaxyproject/planemo/blob/master/planemo/commands/cmd_test.py
     """
     kwds["engine"] = "external_galaxy"
     kwds["shed_install"] = False
     kwds["galaxy_url"] = glx.url
     kwds["galaxy_admin_key"] = glx.user_key
-    kwds["history_name"] = "galaxy_benchmarker-" + str(time.time_ns()) + str(random.randrange(0, 99999))
+    kwds["history_name"] = "galaxy_benchmarker-" + uuid.uuid4().hex[:16]
 
     if user_key is not None:
         kwds["galaxy_user_key"] = user_key
 
+    from planemo.engine import engine_context
+    from planemo.galaxy.test import handle_reports_and_summary
+    from planemo.runnable import for_paths
+
     runnables = for_paths(paths)
 
+    history_id = None
     try:
         with engine_context(ctx, **kwds) as engine:
             test_data = engine.test(runnables)
             exit_code = handle_reports_and_summary(ctx, test_data.structured_data, kwds=kwds)
             status = "success" if exit_code == 0 else "error"
+            history_id = _get_history_id(test_data.structured_data)
     except Exception as e:
         log.error("There was an error: {e}".format(e=e))
         status = "error"
 
-    return {"status": status, "history_name": kwds["history_name"]}
+    result = {"status": status, "history_name": kwds["history_name"]}
+    if history_id is not None:
+        result["history_id"] = history_id
+
+    return result
+
+
+def _get_history_id(structured_data: Dict):
+    """
+    Returns the id of the history the workflow was run in, as reported in the invocation details of Planemo's
+    test results. Returns None, if it's not there (e.g. with older versions of Planemo).
+    """
+    for test in structured_data.get("tests", []):
+        details = test.get("data", {}).get("invocation_details", {}).get("details", {})
+        if details.get("history_id") is not None:
+            return details["history_id"]
+
+    return None
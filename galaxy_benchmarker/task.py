@@ -1,13 +1,45 @@
-from random import randrange
-from typing import Dict
+from concurrent.futures import ThreadPoolExecutor
+from random import choice
+from types import MappingProxyType
+from typing import Callable, Dict, Mapping
+import logging
+
+log = logging.getLogger("GalaxyBenchmarker")
+
+# Params of the BenchmarkerTasks that have none. Read-only, so it can be shared by all of them
+_no_params: Mapping = MappingProxyType({})
 
 class BaseTask:
+    # Maximum number of destinations a task is run on at the same time
+    max_parallel_destinations = 32
+
     def __init__(self, benchmark):
         self.benchmark = benchmark
 
     def run(self):
         raise NotImplementedError
 
+    def _run_on_all_destinations(self, func: Callable):
+        """
+        Calls func for each destination of the benchmark. As these are blocking SSH/HTTP-calls, they are run
+        in parallel, so the task takes as long as the slowest destination instead of the sum of all.
+        Raises the first error that occurred, after all calls are done.
+        """
+        destinations = self.benchmark.destinations
+        if len(destinations) == 0:
+            return
+
+        with ThreadPoolExecutor(max_workers=min(self.max_parallel_destinations, len(destinations))) as executor:
+            futures = [executor.submit(func, destination) for destination in destinations]
+        for future in futures:
+            future.result()
+
+    def run_on_destination(self, destination):
+        """
+        Runs the task on a single destination (see BaseDestination.run_task). Does nothing by default.
+        """
+        pass
+
 
 class AnsiblePlaybookTask(BaseTask):
     def __init__(self, benchmark, playbook):
@@ -15,8 +47,10 @@ class AnsiblePlaybookTask(BaseTask):
         super().__init__(benchmark)
 
     def run(self):
-        for destination in self.benchmark.destinations:
-            destination.run_ansible_playbook_task(self)
+        self._run_on_all_destinations(self.run_on_destination)
+
+    def run_on_destination(self, destination):
+        destination.run_ansible_playbook_task(self)
 
     def __str__(self):
         return "Ansible Playbook: " + self.playbook
@@ -25,56 +59,74 @@ class AnsiblePlaybookTask(BaseTask):
 
 
 class BenchmarkerTask(BaseTask):
-    def __init__(self, benchmark, name, params=dict()):
+    def __init__(self, benchmark, name, params: Mapping = None):
         self.name = name
-        self.params = params
+        self.params = _no_params if params is None else params
         super().__init__(benchmark)
 
+        if name in self._openstack_tasks and "name_contains" not in self.params:
+            raise ValueError("'name_contains' is needed for the BenchmarkerTask {name}".format(name=name))
+
     def run(self):
-        if self.name == "delete_old_histories":
-            for destination in self.benchmark.destinations:
-                self._delete_old_histories(destination)
-        elif self.name == "reboot_openstack_servers":
-            self._reboot_openstack_servers()
-        elif self.name == "reboot_random_openstack_server":
-            self._reboot_random_openstack_server()
-        elif self.name == "rebuild_random_openstack_server":
-            self._rebuild_random_openstack_server()
-        else:
+        handler = self._handlers.get(self.name)
+        if handler is None:
             raise ValueError("{name} is not a valid BenchmarkerTask!".format(name=self.name))
 
+        handler(self)
+
+    def _delete_old_histories_all(self):
+        self._run_on_all_destinations(self._delete_old_histories)
+
     def _delete_old_histories(self, destination):
         destination.galaxy.delete_all_histories_for_user(destination.galaxy_user_name, True)
 
     def _reboot_openstack_servers(self):
-        if "name_contains" not in self.params:
-            raise ValueError("'name_contains' is needed for rebooting openstack servers")
-        reboot_type = self.params["reboot_type"] if "reboot_type" in self.params else "soft"
+        reboot_type = self.params.get("reboot_type", "soft")
 
         os = self.benchmark.benchmarker.openstack
         servers = os.get_servers(self.params["name_contains"])
         os.reboot_servers(servers, reboot_type == "hard")
 
     def _reboot_random_openstack_server(self):
-        if "name_contains" not in self.params:
-            raise ValueError("'name_contains' is needed for rebooting openstack servers")
-        reboot_type = self.params["reboot_type"] if "reboot_type" in self.params else "soft"
+        reboot_type = self.params.get("reboot_type", "soft")
 
         os = self.benchmark.benchmarker.openstack
         servers = os.get_servers(self.params["name_contains"])
+        if not self._check_servers_found(servers):
+            return
 
-        rand_index = randrange(0, len(servers))
-        os.reboot_servers([servers[rand_index]], reboot_type == "hard")
+        os.reboot_servers([choice(servers)], reboot_type == "hard")
 
     def _rebuild_random_openstack_server(self):
-        if "name_contains" not in self.params:
-            raise ValueError("'name_contains' is needed for rebuilding openstack servers")
-
         os = self.benchmark.benchmarker.openstack
         servers = os.get_servers(self.params["name_contains"])
-
-        rand_index = randrange(0, len(servers))
-        os.rebuild_servers([servers[rand_index]])
+        if not self._check_servers_found(servers):
+            return
+
+        os.rebuild_servers([choice(servers)])
+
+    def _check_servers_found(self, servers) -> bool:
+        """
+        Logs a warning, if no server matches name_contains (e.g. as they are still spawning), so the task is
+        skipped instead of aborting the benchmark.
+        """
+        if len(servers) == 0:
+            log.warning("No OpenStack server matches '{name_contains}'. Skipping task {task}."
+                        .format(name_contains=self.params["name_contains"], task=self.name))
+            return False
+        return True
+
+    # Method that runs the task for each valid name
+    _handlers = {
+        "delete_old_histories": _delete_old_histories_all,
+        "reboot_openstack_servers": _reboot_openstack_servers,
+        "reboot_random_openstack_server": _reboot_random_openstack_server,
+        "rebuild_random_openstack_server": _rebuild_random_openstack_server
+    }
+
+    # Tasks that work on the OpenStack servers selected by the param 'name_contains'
+    _openstack_tasks = frozenset({"reboot_openstack_servers", "reboot_random_openstack_server",
+                                  "rebuild_random_openstack_server"})
 
     def __str__(self):
         return self.name
@@ -82,12 +134,17 @@ class BenchmarkerTask(BaseTask):
     __repr__ = __str__
 
 
-def configure_task(task_conf: Dict, benchmark):
-    if task_conf["type"] == "AnsiblePlaybook":
-        return AnsiblePlaybookTask(benchmark, task_conf["playbook"])
+# Builds the task for each allowed task type
+_task_builders = {
+    "AnsiblePlaybook": lambda task_conf, benchmark: AnsiblePlaybookTask(benchmark, task_conf["playbook"]),
+    "BenchmarkerTask": lambda task_conf, benchmark: BenchmarkerTask(benchmark, task_conf["name"],
+                                                                    task_conf.get("params"))
+}
+
 
-    if task_conf["type"] == "BenchmarkerTask":
-        params = task_conf["params"] if "params" in task_conf else {}
-        return BenchmarkerTask(benchmark, task_conf["name"], params)
+def configure_task(task_conf: Dict, benchmark):
+    build_task = _task_builders.get(task_conf["type"])
+    if build_task is None:
+        raise ValueError("Task type '{type}' not allowed!".format(type=task_conf["type"]))
 
-    raise ValueError("Task type '{type}' not allowed!".format(type=task_conf["type"]))
+    return build_task(task_conf, benchmark)
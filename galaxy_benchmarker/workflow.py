@@ -3,6 +3,7 @@ Definition of different workflow-types.
 """
 import os
 import logging
+from functools import lru_cache
 from typing import Dict
 
 log = logging.getLogger("GalaxyBenchmarker")
@@ -33,22 +34,42 @@ class GalaxyWorkflow(BaseWorkflow):
 
 
 class CondorWorkflow(BaseWorkflow):
+    # Expected runtime in seconds. Used to choose how often the status is checked (see CondorDestination)
+    expected_runtime = None
+
     def __init__(self, name, path, job_file):
         super().__init__(name, path)
 
         # Check, if all workflow-directory exist
-        if not os.path.isdir(path):
+        try:
+            entries = _dir_entries(path)
+        except (FileNotFoundError, NotADirectoryError):
             raise IOError("Workflow-Directory at '{path}' in workflow '{wf_name}' could not be found"
                           .format(path=self.path, wf_name=name))
 
         # Check, if condor-job_file exists
-        job_file_path = path + "/" + job_file
-        if not os.path.isfile(job_file_path):
+        job_file_path = os.path.join(path, job_file)
+        if job_file in entries:
+            job_file_exists = entries[job_file].is_file()
+        else:
+            # The job_file may also lie in a subdirectory
+            job_file_exists = os.path.dirname(job_file) != "" and os.path.isfile(job_file_path)
+        if not job_file_exists:
             raise IOError("Job-File at '{path}' in workflow '{wf_name}' could not be found".format(path=job_file_path,
                                                                                                    wf_name=name))
         self.job_file = job_file
 
 
+@lru_cache(maxsize=None)
+def _dir_entries(path) -> Dict[str, os.DirEntry]:
+    """
+    Lists the directory once, so workflows sharing a directory (e.g. on a slow network filesystem) don't need
+    to stat their files one by one. Raises FileNotFoundError/NotADirectoryError, if path is no directory.
+    """
+    with os.scandir(path) as it:
+        return {entry.name: entry for entry in it}
+
+
 def configure_workflow(wf_config: Dict) -> BaseWorkflow:
     """
     Initializes and configures a Workflow according to the given configuration. Returns the configured Workflow.
@@ -71,5 +92,6 @@ def configure_workflow(wf_config: Dict) -> BaseWorkflow:
 
     if wf_config["type"] == "Condor":
         workflow = CondorWorkflow(wf_config["name"], wf_config["path"], wf_config["job_file"])
+        workflow.expected_runtime = wf_config.get("expected_runtime")
 
     return workflow